@@ -1,2 +1,4 @@
 VERSION = (0, 4, 2)
 __version__ = '.'.join(map(str, VERSION))
+
+default_app_config = 'generic_confirmation.apps.GenericConfirmationConfig'
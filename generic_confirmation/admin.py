@@ -1,7 +1,102 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Case, When, Value, CharField, Q
+from django.utils import timezone
+from django.utils.functional import cached_property
 from generic_confirmation.models import DeferredAction
 
-admin.site.register(
-    DeferredAction,
-    list_display=('token', 'valid_until', 'confirmed', 'is_expired')
-)
+
+PENDING = 'pending'
+CONFIRMED = 'confirmed'
+EXPIRED = 'expired'
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Uses the planner's row estimate of PostgreSQL instead of counting all
+    rows when the changelist isn't filtered. Small tables and other
+    databases are counted as usual.
+
+    """
+    estimate_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if getattr(queryset, 'query', None) is not None and not queryset.query.where:
+            connection = connections[queryset.db]
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s",
+                                   [queryset.model._meta.db_table])
+                    row = cursor.fetchone()
+                if row is not None and row[0] >= self.estimate_threshold:
+                    return int(row[0])
+        return super(EstimatedCountPaginator, self).count
+
+
+class StatusListFilter(admin.SimpleListFilter):
+    """ filters by the same conditions as ``pending()``, using its index """
+    title = 'status'
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        return ((PENDING, 'pending'), (CONFIRMED, 'confirmed'), (EXPIRED, 'expired'))
+
+    def queryset(self, request, queryset):
+        if self.value() == PENDING:
+            return queryset.filter(confirmed=False).filter(
+                Q(valid_until__gt=timezone.now()) | Q(valid_until__isnull=True))
+        if self.value() == CONFIRMED:
+            return queryset.filter(confirmed=True)
+        if self.value() == EXPIRED:
+            return queryset.filter(confirmed=False, valid_until__lte=timezone.now())
+        return queryset
+
+
+class DeferredActionAdmin(admin.ModelAdmin):
+    list_display = ('token', 'valid_until', 'confirmed', 'status', 'content_type', 'object_pk')
+    list_filter = (StatusListFilter, 'content_type')
+    list_select_related = ('content_type',)
+    search_fields = ('=token',)
+    # counting all rows of a large table takes longer than the page itself
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    actions = ['expire_selected', 'confirm_selected', 'cancel_selected']
+
+    def get_queryset(self, request):
+        # the form input isn't displayed, the status is computed by the
+        # database instead of calling is_expired() per row
+        return super(DeferredActionAdmin, self).get_queryset(request).defer(
+            'form_input').annotate(status=Case(
+                When(confirmed=True, then=Value(CONFIRMED)),
+                When(valid_until__lte=timezone.now(), then=Value(EXPIRED)),
+                default=Value(PENDING), output_field=CharField()))
+
+    def status(self, obj):
+        return obj.status
+
+    # the actions run as single statements instead of per selected row
+
+    def expire_selected(self, request, queryset):
+        count = DeferredAction.objects.expire_actions(queryset)
+        self.message_user(request, "%d pending actions expired." % count)
+    expire_selected.short_description = "Expire selected pending actions"
+
+    def confirm_selected(self, request, queryset):
+        # resuming the forms needs python, but the actions and the edited
+        # objects are loaded in bulk
+        tokens = list(queryset.values_list('token', flat=True))
+        results = DeferredAction.objects.confirm_many(tokens)
+        count = len([obj for obj in results.values() if obj is not False])
+        self.message_user(request, "%d pending actions confirmed." % count)
+    confirm_selected.short_description = "Confirm selected pending actions"
+
+    def cancel_selected(self, request, queryset):
+        count = DeferredAction.objects.cancel_actions(queryset)
+        self.message_user(request, "%d unconfirmed actions deleted." % count)
+    cancel_selected.short_description = "Delete selected unconfirmed actions"
+
+
+admin.site.register(DeferredAction, DeferredActionAdmin)
@@ -0,0 +1,16 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_migrate
+
+
+class GenericConfirmationConfig(AppConfig):
+    name = 'generic_confirmation'
+
+    def ready(self):
+        from generic_confirmation import registry, cache, content_types
+        registry.load()
+        cache.connect_signals()
+        post_migrate.connect(content_types.clear,
+            dispatch_uid='generic_confirmation.content_types.clear')
+        if getattr(settings, 'GENERIC_CONFIRMATION_PRELOAD_CONTENT_TYPES', False):
+            content_types.load()
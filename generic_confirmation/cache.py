@@ -0,0 +1,130 @@
+"""
+Optional cache for the number of pending actions per object.
+
+Enable it by naming a cache alias in ``GENERIC_CONFIRMATION_PENDING_CACHE``.
+The cached counts are invalidated by the ``confirmation_required``,
+``confirmations_required`` and ``change_confirmed`` signals and expire at
+the latest when the first counted action expires. Bulk changes of all
+objects of a model (``pending_expired`` without object pks,
+``actions_cancelled``) increment a generation per content type instead,
+which is read with the count in one cache round trip.
+
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from generic_confirmation import signals, content_types
+
+
+def get_cache():
+    """ returns the configured cache or None if caching is disabled """
+    alias = getattr(settings, 'GENERIC_CONFIRMATION_PENDING_CACHE', None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def get_timeout():
+    return getattr(settings, 'GENERIC_CONFIRMATION_PENDING_CACHE_TIMEOUT', 300)
+
+
+def pending_key(content_type_id, object_pk):
+    return 'generic_confirmation:pending:%s:%s' % (content_type_id, object_pk)
+
+
+def generation_key(content_type_id):
+    return 'generic_confirmation:generation:%s' % content_type_id
+
+
+def lookup(cache, content_type_id, object_pk):
+    """
+    returns the cached count (or None) and the current generation of the
+    content type, which has to be passed to ``store()``.
+    """
+    key, gen_key = pending_key(content_type_id, object_pk), generation_key(content_type_id)
+    values = cache.get_many([key, gen_key])
+    generation = values.get(gen_key, 0)
+    cached = values.get(key)
+    if cached is None or cached[0] != generation:
+        return None, generation
+    return cached[1], generation
+
+
+def store(cache, content_type_id, object_pk, generation, count, timeout):
+    cache.set(pending_key(content_type_id, object_pk), (generation, count), timeout)
+
+
+def _on_commit(func):
+    func()
+    if hasattr(transaction, 'on_commit'):
+        # a count read before the commit might have been cached meanwhile
+        transaction.on_commit(func)
+
+
+def invalidate_content_type(content_type_id):
+    """ invalidates the cached counts of all objects of a content type """
+    cache = get_cache()
+    if cache is None:
+        return
+    key = generation_key(content_type_id)
+
+    def increment():
+        try:
+            cache.incr(key)
+        except ValueError:
+            # counts cached before the generation was evicted were stored
+            # with an old generation or expire with their timeout
+            cache.set(key, 1, None)
+    _on_commit(increment)
+
+
+def invalidate(actions):
+    """ removes the cached counts of the objects edited by ``actions`` """
+    invalidate_objects([(action.content_type_id, action.object_pk)
+                        for action in actions if action.object_pk is not None])
+
+
+def invalidate_objects(objects):
+    """ removes the cached counts of ``objects``, (content type id, pk) pairs """
+    cache = get_cache()
+    if cache is None or not objects:
+        return
+    keys = [pending_key(content_type_id, object_pk) for content_type_id, object_pk in objects]
+    _on_commit(lambda: cache.delete_many(keys))
+
+
+def confirmation_required(sender, instance, **kwargs):
+    invalidate([instance])
+
+
+def confirmations_required(sender, instances, **kwargs):
+    invalidate(instances)
+
+
+def change_confirmed(sender, instance, **kwargs):
+    invalidate([instance])
+
+
+def pending_expired(sender, object_pks, **kwargs):
+    ct_id = content_types.get_for_model(sender).pk
+    if object_pks is None:
+        invalidate_content_type(ct_id)
+    else:
+        invalidate_objects([(ct_id, pk) for pk in object_pks])
+
+
+def actions_cancelled(sender, **kwargs):
+    invalidate_content_type(content_types.get_for_model(sender).pk)
+
+
+def connect_signals():
+    signals.confirmation_required.connect(confirmation_required,
+        dispatch_uid='generic_confirmation.cache.confirmation_required')
+    signals.confirmations_required.connect(confirmations_required,
+        dispatch_uid='generic_confirmation.cache.confirmations_required')
+    signals.change_confirmed.connect(change_confirmed,
+        dispatch_uid='generic_confirmation.cache.change_confirmed')
+    signals.pending_expired.connect(pending_expired,
+        dispatch_uid='generic_confirmation.cache.pending_expired')
+    signals.actions_cancelled.connect(actions_cancelled,
+        dispatch_uid='generic_confirmation.cache.actions_cancelled')
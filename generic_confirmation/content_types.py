@@ -0,0 +1,63 @@
+"""
+Per-process cache of content types, keyed by model label and by id.
+
+Django's ContentTypeManager caches as well, but its cache is emptied by
+``ContentType.objects.clear_cache()`` from anywhere in a project. The
+lookups on the hot paths of this app (save, confirm, pending_for) go
+through this module and don't issue content type queries once the cache is
+warm. Set ``GENERIC_CONFIRMATION_PRELOAD_CONTENT_TYPES = True`` to fill it
+with all content types in ``AppConfig.ready()``.
+
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.db import DatabaseError
+
+_by_label = {}
+_by_id = {}
+
+
+def _label(model):
+    # like the GenericForeignKey, proxy models use their concrete model
+    opts = model._meta.concrete_model._meta
+    return u"%s.%s" % (opts.app_label, opts.model_name)
+
+
+def _add(ct):
+    _by_id[ct.pk] = ct
+    _by_label[u"%s.%s" % (ct.app_label, ct.model)] = ct
+    return ct
+
+
+def get_for_model(model):
+    """ returns the content type of ``model`` (a model class or instance) """
+    try:
+        return _by_label[_label(model)]
+    except KeyError:
+        return _add(ContentType.objects.get_for_model(model))
+
+
+def get_for_id(id):
+    """ returns the content type with the primary key ``id`` """
+    try:
+        return _by_id[id]
+    except KeyError:
+        return _add(ContentType.objects.get_for_id(id))
+
+
+def load():
+    """ fills the cache with all content types in one query """
+    try:
+        for ct in ContentType.objects.all():
+            _add(ct)
+    except DatabaseError:
+        # the content types table doesn't exist before the first migrate
+        pass
+
+
+def clear(**kwargs):
+    """
+    empties the cache, connected to ``post_migrate`` because content types
+    can be recreated with new ids (e.g. by ``flush``).
+    """
+    _by_label.clear()
+    _by_id.clear()
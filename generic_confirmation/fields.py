@@ -1,7 +1,9 @@
 import base64
 # based on djangosnippets.org/snippets/513 by obeattie
 from django.db import models
+from django.utils import six
 from django.utils.encoding import smart_bytes
+from generic_confirmation.serializers import get_serializer
 
 try:
     import cPickle as pickle
@@ -29,7 +31,7 @@ class PickledObjectField(models.Field):
         else:
             try:
                 return pickle.loads(smart_bytes(base64.b64decode(value)))
-            except:
+            except Exception:
                 # If an error was raised, just return the plain value
                 return value
 
@@ -46,3 +48,74 @@ class PickledObjectField(models.Field):
             return super(PickledObjectField, self).get_lookup(lookup_name)
         else:
             raise TypeError('Lookup type %s is not supported.' % lookup_name)
+
+
+class SerializedFormInput(six.text_type):
+    """
+    The still encoded form input as loaded from the database. The
+    FormInputField only decodes it when the attribute is accessed.
+
+    """
+    pass
+
+
+class FormInputDescriptor(object):
+    """
+    Decodes a SerializedFormInput on first access and keeps the result on
+    the instance, so rows which are loaded but never resumed (lists, counts,
+    cleanup jobs) don't pay for decoding.
+
+    """
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        attname = self.field.attname
+        if attname not in instance.__dict__:
+            # the field was deferred
+            instance.refresh_from_db(fields=[attname])
+        value = instance.__dict__[attname]
+        if isinstance(value, SerializedFormInput):
+            value = instance.__dict__[attname] = get_serializer().loads(value)
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class FormInputField(models.TextField):
+    """
+    Stores the input of a deferred form with the serializer configured in
+    ``GENERIC_CONFIRMATION_SERIALIZER``. The value is decoded lazily on
+    attribute access, ``values()`` and ``values_list()`` return the encoded
+    string.
+
+    """
+    def contribute_to_class(self, cls, name, **kwargs):
+        super(FormInputField, self).contribute_to_class(cls, name, **kwargs)
+        setattr(cls, self.attname, FormInputDescriptor(self))
+
+    def from_db_value(self, value, expression, connection, context):
+        if value is None:
+            return value
+        return SerializedFormInput(value)
+
+    def pre_save(self, model_instance, add):
+        # bypass the descriptor, so an untouched value isn't decoded
+        return model_instance.__dict__[self.attname]
+
+    def get_prep_value(self, value):
+        if value is None:
+            return value
+        if isinstance(value, SerializedFormInput):
+            # loaded but never touched, no need to encode it again
+            return six.text_type(value)
+        return get_serializer().dumps(value)
+
+    def get_lookup(self, lookup_name):
+        if lookup_name in ('exact', 'in', 'isnull'):
+            return super(FormInputField, self).get_lookup(lookup_name)
+        else:
+            raise TypeError('Lookup type %s is not supported.' % lookup_name)
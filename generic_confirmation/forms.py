@@ -1,9 +1,9 @@
-import random
 from django import forms
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
 from generic_confirmation.models import DeferredAction
-from generic_confirmation.main import LONG
-from generic_confirmation import signals
+from generic_confirmation.main import LONG, random_token, sign_token
+from generic_confirmation import signals, registry, content_types, notifications, metrics, throttle
 
 
 class DeferredFormMixIn(object):
@@ -16,25 +16,78 @@ class DeferredFormMixIn(object):
     """
 
     token_format = LONG
+    # None uses the setting GENERIC_CONFIRMATION_SIGN_TOKENS
+    sign_tokens = None
+    # expire older pending actions of this form for the same object on save()
+    supersede = False
 
-    def _gen_token(self, format=None, step=0):
+    def _gen_token(self, format=None):
         """
-        generates a unique (in terms of DeferredAction objects) token based
-        on the format tuple in the form of (alphabet, length).
+        generates a random token based on the format tuple in the form of
+        (alphabet, length). Uniqueness is not checked here, it is enforced
+        by the database when the DeferredAction is inserted.
         """
         if format is None:
             format = self.token_format
-        chars, length = format
-        token = u''.join([random.choice(chars) for i in range(length)])
-        try:
-            DeferredAction.objects.get(token=token)
-        except DeferredAction.DoesNotExist:
-            return token
-        if step > 9:
-            raise Exception("10 attempts to generate a unique token failed.")
-        return self._gen_token(format=format, step=step+1)
-
-    def save(self, user=None, valid_until=None, description=None, **kwargs):
+        return random_token(format)
+
+    def _new_token(self, valid_until=None):
+        """
+        returns a new token for an action valid until ``valid_until``,
+        signed if ``sign_tokens`` is enabled.
+        """
+        token = self._gen_token()
+        sign_tokens = self.sign_tokens
+        if sign_tokens is None:
+            sign_tokens = getattr(settings, 'GENERIC_CONFIRMATION_SIGN_TOKENS', False)
+        if sign_tokens:
+            token = sign_token(token, valid_until)
+        return token
+
+    def _create_action(self, data, attempts=10):
+        """
+        inserts a DeferredAction with a freshly generated token. A token
+        collision makes the INSERT fail, in which case a new token is
+        generated and the INSERT is retried.
+        """
+        for step in range(attempts):
+            data['token'] = self._new_token(data['valid_until'])
+            metrics.incr('token.attempts')
+            try:
+                with metrics.timer('action.insert'), transaction.atomic():
+                    return DeferredAction.objects.create(**data)
+            except IntegrityError:
+                # only retry if the error was caused by the token
+                if not DeferredAction.objects.filter(token=data['token']).exists():
+                    raise
+                metrics.incr('token.collisions')
+        raise Exception("%d attempts to generate a unique token failed." % attempts)
+
+    def _action_data(self, user=None, valid_until=None, description=None):
+        """
+        returns the field values of the DeferredAction which stores this form.
+        ``content_type`` and ``object_pk`` are set up front (``object_pk`` is
+        None for forms creating a new object), so that storing the action
+        needs only one INSERT.
+        """
+        form_class_name = registry.form_class_name(self.__class__)
+
+        # we save the uncleaned data here, because form.full_clean() will
+        # alter the data in cleaned_data and a second run with cleaned_data as
+        # form input will fail for foreignkeys and manytomany fields.
+        # additionally, storing the original input is a bit safer, because
+        # this is only data which was transfered over http, so we won't
+        # get any serialization errors here
+        data = {'form_class':form_class_name, 'form_input':self.data,
+                'form_prefix': self.prefix, 'valid_until': valid_until,
+                'description': description, 'user': user}
+
+        if getattr(self, 'instance', None) is not None:
+            data['content_type'] = content_types.get_for_model(self.instance)
+            data['object_pk'] = self.instance.pk
+        return data
+
+    def save(self, user=None, valid_until=None, description=None, supersede=None, **kwargs):
         """
         Replaces the ModelForm save method with our own to defer the action
         by storing the data in the db.
@@ -46,42 +99,107 @@ class DeferredFormMixIn(object):
         * user (User object): the user requesting the change
         * valid_until (datetime): until when the action can be confirmed
         * description (string): saved with the action object
+        * supersede (bool): expire older pending actions of this form for
+          the same object, defaults to the ``supersede`` attribute
 
         """
         if not self.is_valid():
             raise Exception("only call save() on a form after calling is_valid().")
 
-        form_class_name = u"%s.%s" % (self.__class__.__module__,
-                                      self.__class__.__name__)
+        data = self._action_data(user, valid_until, description)
 
-        # we save the uncleaned data here, because form.full_clean() will
-        # alter the data in cleaned_data and a second run with cleaned_data as
-        # form input will fail for foreignkeys and manytomany fields.
-        # additionally, storing the original input is a bit safer, because
-        # this is only data which was transfered over http, so we won't
-        # get any pickle errors here
-        data = {'form_class':form_class_name, 'form_input':self.data,
-                'token':self._gen_token(), 'form_prefix': self.prefix,
-                'valid_until': valid_until, 'description': description,
-                'user': user}
-
-        defer = DeferredAction.objects.create(**data)
-
-        if self.instance is not None:
-            # this extra step makes sure that ModelForms for editing and for
-            # creating objects both work.
-            defer.instance_object = self.instance
-            defer.save()
+        if supersede is None:
+            supersede = self.supersede
+        if supersede and data.get('object_pk') is not None:
+            with transaction.atomic():
+                DeferredAction.objects.expire_pending_for(
+                    self.instance, form_class=data['form_class'])
+                defer = self._create_action(data)
+        else:
+            defer = self._create_action(data)
 
         # inform anyone else that confirmation is requested
-        signals.confirmation_required.send(sender=self._meta.model,
-                                        instance=defer, user=user)
+        with metrics.timer('signal.confirmation_required'):
+            signals.confirmation_required.send(sender=self._meta.model,
+                                            instance=defer, user=user)
 
-        if hasattr(self, 'send_notification') and callable(self.send_notification):
-            self.send_notification(user, instance=defer)
+        notifications.dispatch(self, user, defer)
 
         return defer.token
 
+    @classmethod
+    def bulk_save(cls, forms, user=None, valid_until=None, description=None,
+                  batch_size=1000):
+        """
+        Defers the save of many forms at once. The DeferredAction objects are
+        written with ``bulk_create`` in batches of ``batch_size`` and a single
+        ``confirmations_required`` signal is sent per batch instead of one
+        ``confirmation_required`` signal per form.
+        Returns the list of tokens in the same order as ``forms``.
+
+        The parameters ``user``, ``valid_until`` and ``description`` are
+        used for all forms, see ``save()``.
+
+        """
+        forms = list(forms)
+        actions = []
+        for form in forms:
+            if not form.is_valid():
+                raise Exception("only call bulk_save() with valid forms.")
+            actions.append(DeferredAction(**form._action_data(user, valid_until, description)))
+
+        for start in range(0, len(actions), batch_size):
+            batch_forms = forms[start:start+batch_size]
+            batch = actions[start:start+batch_size]
+            cls._bulk_create_actions(batch_forms, batch)
+
+            # inform anyone else that confirmation is requested, grouped
+            # by the edited class
+            by_model = {}
+            for form, action in zip(batch_forms, batch):
+                by_model.setdefault(form._meta.model, []).append(action)
+            with metrics.timer('signal.confirmations_required'):
+                for model, instances in by_model.items():
+                    signals.confirmations_required.send(sender=model,
+                                                    instances=instances, user=user)
+
+            for form, action in zip(batch_forms, batch):
+                notifications.dispatch(form, user, action)
+
+        return [action.token for action in actions]
+
+    @staticmethod
+    def _bulk_create_actions(forms, actions, attempts=10):
+        """
+        assigns fresh tokens to ``actions`` and inserts them with one
+        ``bulk_create``. Tokens colliding with each other or with existing
+        rows are replaced before the INSERT, if another process inserts the
+        same token in the meantime the whole batch is retried.
+        """
+        for step in range(attempts):
+            for form, action in zip(forms, actions):
+                action.token = form._new_token(action.valid_until)
+            taken = set(DeferredAction.objects.filter(
+                token__in=[action.token for action in actions]
+                ).values_list('token', flat=True))
+            seen = set()
+            collisions = 0
+            for form, action in zip(forms, actions):
+                if action.token in taken or action.token in seen:
+                    action.token = form._new_token(action.valid_until)
+                    collisions += 1
+                seen.add(action.token)
+            metrics.incr('token.attempts', len(actions) + collisions)
+            if collisions:
+                metrics.incr('token.collisions', collisions)
+            try:
+                with metrics.timer('action.bulk_insert'), transaction.atomic():
+                    DeferredAction.objects.bulk_create(actions)
+                return
+            except IntegrityError:
+                metrics.incr('token.collisions')
+        raise Exception("%d attempts to generate unique tokens failed." % attempts)
+
     def save_original(self, *args, **kwargs):
         """
         triggr the original ModelForm save
@@ -102,18 +220,28 @@ class DeferredForm(DeferredFormMixIn, forms.ModelForm):
 class ConfirmationForm(forms.Form):
     """
     Form to use in views to confirm an action with a token.
-    Makes sure the token exists and on calling ``save()``
-    will resume the defered action.
+    Makes sure the token exists and is neither confirmed nor
+    expired and on calling ``save()`` will resume the defered action.
 
     """
     token = forms.CharField(required=True)
+    action = None
 
     def clean_token(self):
-        try:
-            obj = DeferredAction.objects.get(token=self.cleaned_data['token'])
-            return self.cleaned_data['token']
-        except DeferredAction.DoesNotExist:
+        token = self.cleaned_data['token']
+        # repeated guesses are rejected without a query
+        if throttle.is_token_throttled(token):
+            metrics.incr('confirm.throttled')
+            raise forms.ValidationError(u"too many attempts, try again later") #FIXME: i18n
+        if throttle.is_known_unknown(token):
+            metrics.incr('confirm.unknown')
+            raise forms.ValidationError(u"wrong token") #FIXME: i18n
+        # keep the action, so save() doesn't need to load it again
+        self.action = DeferredAction.objects.get_pending(token)
+        if self.action is None:
+            throttle.token_failed(token)
             raise forms.ValidationError(u"wrong token") #FIXME: i18n
+        return token
 
     def save(self):
-        return DeferredAction.objects.confirm(token=self.cleaned_data['token'])
+        return DeferredAction.objects.confirm_action(self.action)
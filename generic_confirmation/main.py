@@ -1,6 +1,79 @@
+import os
+import calendar
+from django.core import signing
+from django.utils import baseconv, timezone
+
 # token format definitions
 # (<alphabet>, <length>)
 # alphabet here is without ijl10O which could easily be misread in some fonts
 LONG = ('abcdefghkmnopqrstuvwwxyzABCDEFGHKLMNPQRSTUVWXYZ23456789', 24) # for emails
 SHORT = ('abcdefghkmnopqrstuvwwxyzABCDEFGHKLMNPQRSTUVWXYZ23456789', 6) # because we can =)
 SHORT_UPPER = ('ABCDEFGHKLMNPQRSTUVWXYZ23456789', 6) # for sms
+
+
+def random_token(format):
+    """
+    returns a random token based on the format tuple in the form of
+    (alphabet, length). The random bytes are drawn in bulk from
+    ``os.urandom`` and mapped onto the alphabet.
+    """
+    chars, length = format
+    # bytes above the largest multiple of len(chars) are skipped, otherwise
+    # the first characters of the alphabet would be picked more often
+    limit = 256 - (256 % len(chars))
+    token = []
+    while len(token) < length:
+        for byte in bytearray(os.urandom(length * 2)):
+            if byte < limit:
+                token.append(chars[byte % len(chars)])
+                if len(token) == length:
+                    break
+    return u''.join(token)
+
+
+# signed tokens carry their expiry and a signature, so that forged and expired
+# tokens are rejected without a database query. the separator is not part of
+# any alphabet above, which tells signed and plain tokens apart.
+SIGNED_TOKEN_SEP = '.'
+
+VALID = 'valid'
+UNSIGNED = 'unsigned'
+BAD_SIGNATURE = 'bad_signature'
+EXPIRED = 'expired'
+
+
+def _signer():
+    return signing.Signer(salt='generic_confirmation.token', sep=SIGNED_TOKEN_SEP)
+
+
+def _timestamp(value):
+    return calendar.timegm(value.utctimetuple())
+
+
+def sign_token(token, valid_until=None):
+    """
+    returns ``token`` signed with the SECRET_KEY, including ``valid_until``
+    (rounded up to the second) if given.
+    """
+    if valid_until is not None:
+        expires = _timestamp(valid_until) + (1 if valid_until.microsecond else 0)
+        token = token + SIGNED_TOKEN_SEP + baseconv.base62.encode(expires)
+    return _signer().sign(token)
+
+
+def verify_token(token):
+    """
+    checks the signature and expiry of a signed token without touching the
+    database. Returns ``VALID``, ``BAD_SIGNATURE`` or ``EXPIRED``, or
+    ``UNSIGNED`` for plain tokens, which can only be checked in the database.
+    """
+    if SIGNED_TOKEN_SEP not in token:
+        return UNSIGNED
+    try:
+        value = _signer().unsign(token)
+    except signing.BadSignature:
+        return BAD_SIGNATURE
+    expires = value.partition(SIGNED_TOKEN_SEP)[2]
+    if expires and int(baseconv.base62.decode(expires)) <= _timestamp(timezone.now()):
+        return EXPIRED
+    return VALID
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from datetime import timedelta
+from generic_confirmation.models import DeferredAction
+
+
+class Command(BaseCommand):
+    help = ("Moves confirmed and expired deferred actions to the archive in "
+            "batches of primary key ranges.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+            help="Keep actions which were confirmed or expired less than DAYS "
+                 "days ago. Defaults to GENERIC_CONFIRMATION_RETENTION_DAYS.")
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help="Size of the primary key range moved per transaction.")
+        parser.add_argument('--dry-run', action='store_true', default=False,
+            help="Only count the actions which would be archived.")
+
+    def handle(self, *args, **options):
+        retention = None
+        if options['days'] is not None:
+            retention = timedelta(days=options['days'])
+
+        if options['dry_run']:
+            count = DeferredAction.objects.archive(retention=retention, dry_run=True)
+            self.stdout.write("%d actions would be archived." % count)
+            return
+
+        verbosity = options['verbosity']
+
+        def progress(archived, last_pk, max_pk):
+            if verbosity > 0:
+                self.stdout.write("archived %d actions, at pk %d of %d" % (
+                    archived, last_pk, max_pk))
+
+        count = DeferredAction.objects.archive(retention=retention,
+            batch_size=options['batch_size'], progress=progress)
+        self.stdout.write("%d actions archived." % count)
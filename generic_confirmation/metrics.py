@@ -0,0 +1,131 @@
+"""
+Optional metrics for deferring and confirming actions.
+
+The setting ``GENERIC_CONFIRMATION_METRICS_BACKEND`` names the backend which
+receives counters and timings, by default nothing is recorded. To export the
+metrics to StatsD, Prometheus or similar, subclass ``BaseBackend`` and
+implement ``incr()`` and ``timing()``.
+
+Recorded metrics:
+
+* ``token.attempts``, ``token.collisions``: generated tokens and tokens
+  which were already taken
+* ``action.insert``: time to INSERT a DeferredAction (``action.bulk_insert``
+  for a batch of ``bulk_save()``)
+* ``resume.validate``, ``resume.save``: time to validate and save the
+  resumed form when confirming
+* ``signal.<name>``: time spent in the receivers of our signals
+* ``notification.send``: time to send a notification,
+  ``notification.retries`` and ``notification.failed``
+* ``confirm.success``, ``confirm.expired``, ``confirm.unknown``,
+  ``confirm.already_confirmed``, ``confirm.bad_signature``,
+  ``confirm.throttled``: outcomes of confirmations
+
+"""
+import time
+import logging
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class Timer(object):
+    """ context manager reporting its duration to ``backend.timing()`` """
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.backend.timing(self.name, (time.time() - self.start) * 1000.0)
+
+
+class NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class BaseBackend(object):
+    def incr(self, name, value=1):
+        """ increments the counter ``name`` by ``value`` """
+        raise NotImplementedError
+
+    def timing(self, name, milliseconds):
+        """ records a duration of ``milliseconds`` for ``name`` """
+        raise NotImplementedError
+
+    def timer(self, name):
+        return Timer(self, name)
+
+
+class NullBackend(BaseBackend):
+    """ records nothing, the default """
+    null_timer = NullTimer()
+
+    def incr(self, name, value=1):
+        pass
+
+    def timing(self, name, milliseconds):
+        pass
+
+    def timer(self, name):
+        return self.null_timer
+
+
+class LoggingBackend(BaseBackend):
+    """ logs all metrics to the ``generic_confirmation.metrics`` logger """
+    logger = logging.getLogger('generic_confirmation.metrics')
+
+    def incr(self, name, value=1):
+        self.logger.debug("%s +%d", name, value)
+
+    def timing(self, name, milliseconds):
+        self.logger.debug("%s %.3fms", name, milliseconds)
+
+
+class MemoryBackend(BaseBackend):
+    """
+    keeps counters and timings in memory of the current process, e.g. to be
+    read by an exporter or in tests.
+
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.timings = {}
+
+    def incr(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def timing(self, name, milliseconds):
+        self.timings.setdefault(name, []).append(milliseconds)
+
+
+_backends = {}
+
+
+def get_backend():
+    """ returns the configured backend instance """
+    path = getattr(settings, 'GENERIC_CONFIRMATION_METRICS_BACKEND',
+                   'generic_confirmation.metrics.NullBackend')
+    try:
+        return _backends[path]
+    except KeyError:
+        backend = _backends[path] = import_string(path)()
+        return backend
+
+
+def incr(name, value=1):
+    get_backend().incr(name, value)
+
+
+def timer(name):
+    """ returns a context manager recording the duration of its block """
+    return get_backend().timer(name)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import Count
+from generic_confirmation.main import LONG, random_token
+
+
+def regenerate_duplicate_tokens(apps, schema_editor):
+    """
+    gives every action but the oldest of a duplicated token a new random
+    token, otherwise the unique constraint can't be added. Links sent for
+    the changed actions don't work anymore, but before they confirmed
+    whichever action was found first anyway.
+    """
+    DeferredAction = apps.get_model('generic_confirmation', 'DeferredAction')
+    actions = DeferredAction.objects.using(schema_editor.connection.alias)
+    duplicates = actions.values('token').annotate(
+        count=Count('pk')).filter(count__gt=1).values_list('token', flat=True)
+    for token in list(duplicates):
+        pks = list(actions.filter(token=token).order_by('pk').values_list('pk', flat=True))
+        for pk in pks[1:]:
+            new_token = random_token(LONG)
+            while actions.filter(token=new_token).exists():
+                new_token = random_token(LONG)
+            actions.filter(pk=pk).update(token=new_token)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generic_confirmation', '0003_deferredaction_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(regenerate_duplicate_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='deferredaction',
+            name='token',
+            field=models.CharField(max_length=40, unique=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='deferredaction',
+            index_together=set([('confirmed', 'valid_until')]),
+        ),
+    ]
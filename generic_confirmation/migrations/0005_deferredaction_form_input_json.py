@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import generic_confirmation.fields
+from generic_confirmation.serializers import JSONSerializer, PickleSerializer
+
+BATCH_SIZE = 1000
+
+
+def convert_form_input(apps, schema_editor, source, target):
+    """
+    re-encodes the stored form input of all actions from the ``source`` to
+    the ``target`` serializer. The raw column values are read and written
+    with plain SQL, so the field class of the historical model doesn't
+    matter.
+    """
+    DeferredAction = apps.get_model('generic_confirmation', 'DeferredAction')
+    connection = schema_editor.connection
+    table = connection.ops.quote_name(DeferredAction._meta.db_table)
+    queryset = DeferredAction.objects.using(connection.alias).order_by('pk')
+    last_pk = 0
+    while True:
+        pks = list(queryset.filter(pk__gt=last_pk).values_list('pk', flat=True)[:BATCH_SIZE])
+        if not pks:
+            break
+        last_pk = pks[-1]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT id, form_input FROM %s WHERE id IN (%s)" % (
+                    table, ', '.join(['%s'] * len(pks))), pks)
+            rows = cursor.fetchall()
+            cursor.executemany(
+                "UPDATE %s SET form_input = %%s WHERE id = %%s" % table,
+                [(target.dumps(source.loads(data)), pk)
+                 for pk, data in rows if data is not None])
+
+
+def pickle_to_json(apps, schema_editor):
+    convert_form_input(apps, schema_editor, PickleSerializer(), JSONSerializer())
+
+
+def json_to_pickle(apps, schema_editor):
+    convert_form_input(apps, schema_editor, JSONSerializer(), PickleSerializer())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generic_confirmation', '0004_deferredaction_token_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deferredaction',
+            name='form_input',
+            field=generic_confirmation.fields.FormInputField(editable=False),
+        ),
+        migrations.RunPython(pickle_to_json, json_to_pickle),
+    ]
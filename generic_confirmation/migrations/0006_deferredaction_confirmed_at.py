@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generic_confirmation', '0005_deferredaction_form_input_json'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deferredaction',
+            name='confirmed_at',
+            field=models.DateTimeField(null=True, blank=True),
+        ),
+    ]
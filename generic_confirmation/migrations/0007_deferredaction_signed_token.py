@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generic_confirmation', '0006_deferredaction_confirmed_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deferredaction',
+            name='token',
+            field=models.CharField(max_length=128, unique=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+import generic_confirmation.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contenttypes', '0001_initial'),
+        ('generic_confirmation', '0007_deferredaction_signed_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedDeferredAction',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('action_id', models.IntegerField(db_index=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('token', models.CharField(max_length=128, db_index=True)),
+                ('valid_until', models.DateTimeField(null=True)),
+                ('confirmed', models.BooleanField(default=False)),
+                ('confirmed_at', models.DateTimeField(null=True, blank=True)),
+                ('form_class', models.CharField(max_length=255)),
+                ('form_input', generic_confirmation.fields.FormInputField(editable=False)),
+                ('form_prefix', models.CharField(max_length=255, null=True, blank=True)),
+                ('object_pk', models.CharField(max_length=255, null=True)),
+                ('description', models.TextField(null=True, blank=True)),
+                ('content_type', models.ForeignKey(to='contenttypes.ContentType', null=True, on_delete=models.CASCADE)),
+                ('user', models.ForeignKey(blank=True, to=settings.AUTH_USER_MODEL, null=True, on_delete=models.CASCADE)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='archiveddeferredaction',
+            index_together=set([('content_type', 'object_pk')]),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generic_confirmation', '0008_archiveddeferredaction'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deferredaction',
+            name='object_pk',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='deferredaction',
+            index_together=set([('confirmed', 'valid_until'), ('content_type', 'object_pk', 'confirmed')]),
+        ),
+    ]
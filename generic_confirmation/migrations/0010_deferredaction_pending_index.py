@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generic_confirmation', '0009_deferredaction_object_index'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='deferredaction',
+            index_together=set([('confirmed', 'valid_until'), ('content_type', 'object_pk', 'confirmed', 'valid_until')]),
+        ),
+    ]
@@ -1,49 +1,382 @@
+import math
+from datetime import timedelta
+from django import VERSION
 from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
 from django.utils import timezone
-from django.db import models
-from django.db.models.query import Q
+from django.utils.encoding import force_text
+from django.db import models, transaction
+from django.db.models import Count, Min, Max
+from django.db.models.query import Q, QuerySet
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
-from generic_confirmation.fields import PickledObjectField
-from generic_confirmation import signals
+from generic_confirmation.fields import FormInputField
+from generic_confirmation import main
+from generic_confirmation import signals, registry, content_types, metrics
+from generic_confirmation import cache as pending_cache
+
+
+def delete_counted(queryset):
+    """ deletes ``queryset`` and returns the number of deleted rows """
+    if VERSION < (1, 9):
+        # delete() returns nothing before Django 1.9
+        with transaction.atomic():
+            count = queryset.count()
+            queryset.delete()
+        return count
+    return queryset.delete()[0]
 
 
 class ConfirmationManager(models.Manager):
     def confirm(self, token):
+        action = self.get_pending(token)
+        if action is None:
+            return False
+
+        return self.confirm_action(action)
+
+    def get_pending(self, token):
+        """
+        returns the pending action for ``token`` or None. The action is
+        loaded regardless of its state, so that the reason for a failed
+        confirmation can be recorded without another query. Forged and
+        expired signed tokens are rejected without any query.
+        """
+        if not self._check_token(token):
+            return None
         try:
-            action = self.exclude(confirmed=True).get(token=token)
+            action = self.get(token=token)
         except self.model.DoesNotExist:
+            metrics.incr('confirm.unknown')
+            return None
+        return action if self._is_pending(action, timezone.now()) else None
+
+    def _check_token(self, token):
+        """
+        verifies the signature of ``token``, unsigned tokens are rejected if
+        ``GENERIC_CONFIRMATION_REQUIRE_SIGNED_TOKENS`` is set.
+        """
+        status = main.verify_token(token)
+        if status == main.UNSIGNED and getattr(
+                settings, 'GENERIC_CONFIRMATION_REQUIRE_SIGNED_TOKENS', False):
+            status = main.BAD_SIGNATURE
+        if status in (main.BAD_SIGNATURE, main.EXPIRED):
+            metrics.incr('confirm.%s' % status)
+            return False
+        return True
+
+    def _is_pending(self, action, now):
+        """ like ``pending()`` for a loaded action, records failures """
+        if action.confirmed:
+            metrics.incr('confirm.already_confirmed')
+            return False
+        if action.valid_until is not None and action.valid_until <= now:
+            metrics.incr('confirm.expired')
             return False
+        return True
 
-        if not action.is_expired():
-            obj = action.resume_form_save()
+    def confirm_many(self, tokens):
+        """
+        confirms the actions for all ``tokens``. The actions are loaded with
+        one query and the edited objects with one query per model, instead
+        of one query per action for each.
+        Returns a dict mapping each token to the saved object or False.
+        """
+        results = dict((token, False) for token in tokens)
+        checked = [token for token in results if self._check_token(token)]
+        now = timezone.now()
+        loaded = list(self.filter(token__in=checked)) if checked else []
+        if len(loaded) < len(checked):
+            metrics.incr('confirm.unknown', len(checked) - len(loaded))
+        actions = [action for action in loaded if self._is_pending(action, now)]
+
+        object_pks = {}
+        for action in actions:
+            if action.content_type_id is not None and action.object_pk is not None:
+                object_pks.setdefault(action.content_type_id, set()).add(action.object_pk)
+
+        instances = {}
+        for ct_id, pks in object_pks.items():
+            model = content_types.get_for_id(ct_id).model_class()
+            for pk, obj in model._base_manager.in_bulk(list(pks)).items():
+                instances[(ct_id, force_text(pk))] = obj
+
+        for action in actions:
+            instance = instances.get((action.content_type_id, force_text(action.object_pk)))
+            results[action.token] = self.confirm_action(action, instance=instance)
+        return results
+
+    def confirm_action(self, action, instance=None):
+        """
+        confirms an already loaded ``action`` (e.g. by ``ConfirmationForm``),
+        costing one conditional UPDATE plus resuming the form. Returns the
+        saved object or False, if the action was confirmed, expired or
+        superseded meanwhile.
+        """
+        with transaction.atomic():
+            # claim the action with a conditional UPDATE, so that only one
+            # of several concurrent confirmations can resume the form and
+            # an action expired after it was loaded can't be confirmed. if
+            # resuming fails, the claim is rolled back.
+            now = timezone.now()
+            if not self.pending().filter(pk=action.pk).update(
+                    confirmed=True, confirmed_at=now):
+                confirmed = self.filter(pk=action.pk).values_list('confirmed', flat=True)
+                metrics.incr('confirm.already_confirmed' if any(confirmed)
+                             else 'confirm.expired')
+                return False
+            # confirmed actions are kept, purge() removes them later
             action.confirmed = True
-            action.save()  # FIXME: should we also call delete() here?
-            # inform everyone else, that a change was confirmed
+            action.confirmed_at = now
+            obj = action.resume_form_save(instance=instance)
+        metrics.incr('confirm.success')
+
+        # inform everyone else, that a change was confirmed
+        with metrics.timer('signal.change_confirmed'):
             signals.change_confirmed.send(sender=obj._meta.model, instance=action)
-            return obj
+        return obj
 
-        return False
+    def pending(self):
+        """ returns the actions which are neither confirmed nor expired """
+        now = timezone.now()
+        return self.filter(confirmed=False).filter(
+                Q(valid_until__gt=now) | Q(valid_until__isnull=True))
 
     def pending_for(self, instance):
-        ct = ContentType.objects.get_for_model(instance)
+        """
+        returns the number of pending actions for ``instance``. If
+        ``GENERIC_CONFIRMATION_PENDING_CACHE`` is set, the count is cached
+        until it changes or the first of the counted actions expires.
+        """
+        ct = content_types.get_for_model(instance)
+        queryset = self.pending().filter(content_type=ct, object_pk=instance.pk)
+        cache = pending_cache.get_cache()
+        if cache is None:
+            return queryset.count()
+
+        count, generation = pending_cache.lookup(cache, ct.pk, instance.pk)
+        if count is None:
+            result = queryset.aggregate(count=Count('pk'), expires=Min('valid_until'))
+            count = result['count']
+            timeout = pending_cache.get_timeout()
+            if result['expires'] is not None:
+                seconds = (result['expires'] - timezone.now()).total_seconds()
+                timeout = max(1, min(timeout, int(math.ceil(seconds))))
+            pending_cache.store(cache, ct.pk, instance.pk, generation, count, timeout)
+        return count
+
+    def pending_counts_for(self, objects):
+        """
+        returns a dict mapping the primary key of each object in ``objects``
+        (a queryset or list of instances of one model) to its number of
+        pending actions, using one grouped query instead of one
+        ``pending_for()`` query per object.
+        """
+        objects = list(objects)
+        if not objects:
+            return {}
+        ct = content_types.get_for_model(objects[0])
+        counts = dict(self.pending().filter(content_type=ct,
+                object_pk__in=[force_text(obj.pk) for obj in objects]
+                ).order_by().values_list('object_pk').annotate(Count('pk')))
+        return dict((obj.pk, counts.get(force_text(obj.pk), 0)) for obj in objects)
+
+    def expire_pending_for(self, target, form_class=None):
+        """
+        expires the pending actions for ``target``: a model instance, a
+        queryset of one model or a model class for all of its objects,
+        optionally only those of ``form_class`` (a dotted path). The
+        actions are updated with one UPDATE (per 500 objects of a queryset)
+        and a single ``pending_expired`` signal is sent. Returns the number
+        of expired actions.
+        """
+        if isinstance(target, models.Model):
+            model, object_pks = target.__class__, [target.pk]
+        elif isinstance(target, QuerySet):
+            model, object_pks = target.model, list(target.values_list('pk', flat=True))
+        else:
+            model, object_pks = target, None
+
+        queryset = self.pending().filter(content_type=content_types.get_for_model(model))
+        if form_class is not None:
+            queryset = queryset.filter(form_class=form_class)
+        now = timezone.now()
+        if object_pks is None:
+            count = queryset.update(valid_until=now)
+        else:
+            count = 0
+            # stay below the parameter limit of SQLite
+            for start in range(0, len(object_pks), 500):
+                count += queryset.filter(object_pk__in=[force_text(pk)
+                        for pk in object_pks[start:start+500]]).update(valid_until=now)
+        signals.pending_expired.send(sender=model, object_pks=object_pks, count=count)
+        return count
+
+    def expire_actions(self, actions):
+        """
+        expires the pending actions among ``actions`` (a queryset of
+        DeferredAction) with one UPDATE per 500 actions. One
+        ``pending_expired`` signal is sent per edited model. Returns the
+        number of expired actions.
+        """
+        counts = {}
+        count = 0
         now = timezone.now()
-        return self.exclude(confirmed=True).filter(content_type=ct,
-                object_pk=instance.pk).filter(
-                Q(valid_until__gt=now) | Q(valid_until__isnull=True)).count()
+        for queryset in self._chunks(actions, self.pending()):
+            self._count_by_model(queryset, counts)
+            count += queryset.update(valid_until=now)
+        for model, model_count in counts.items():
+            signals.pending_expired.send(sender=model, object_pks=None, count=model_count)
+        return count
+
+    def cancel_for_user(self, user):
+        """
+        deletes the unconfirmed actions requested by ``user`` with one
+        DELETE. Returns the number of deleted actions.
+        """
+        return self._cancel([self.filter(user=user, confirmed=False)], user)
+
+    def cancel_actions(self, actions):
+        """
+        deletes the unconfirmed actions among ``actions`` with one DELETE
+        per 500 actions
+        """
+        return self._cancel(self._chunks(actions, self.filter(confirmed=False)))
+
+    def _chunks(self, actions, queryset, size=500):
+        """
+        yields ``queryset`` restricted to chunks of the primary keys of
+        ``actions``. The keys are loaded first, because MySQL can't UPDATE
+        or DELETE from a table with a subquery on the same table.
+        """
+        pks = list(actions.order_by().values_list('pk', flat=True))
+        for start in range(0, len(pks), size):
+            yield queryset.filter(pk__in=pks[start:start+size])
+
+    def _cancel(self, querysets, user=None):
+        counts = {}
+        count = 0
+        for queryset in querysets:
+            self._count_by_model(queryset, counts)
+            count += delete_counted(queryset)
+        for model, model_count in counts.items():
+            signals.actions_cancelled.send(sender=model, user=user, count=model_count)
+        return count
+
+    def _count_by_model(self, queryset, counts):
+        """ adds the number of actions in ``queryset`` per edited model to ``counts`` """
+        for ct_id, count in queryset.order_by().filter(content_type__isnull=False
+                ).values_list('content_type_id').annotate(Count('pk')):
+            model = content_types.get_for_id(ct_id).model_class()
+            counts[model] = counts.get(model, 0) + count
+
+    def purgeable(self, retention=None):
+        """
+        returns the actions which were confirmed or expired more than
+        ``retention`` (a timedelta, defaults to the setting
+        ``GENERIC_CONFIRMATION_RETENTION_DAYS``) ago.
+        """
+        if retention is None:
+            retention = timedelta(
+                days=getattr(settings, 'GENERIC_CONFIRMATION_RETENTION_DAYS', 0))
+        cutoff = timezone.now() - retention
+        return self.filter(
+            Q(confirmed=True, confirmed_at__lt=cutoff) |
+            Q(confirmed=True, confirmed_at__isnull=True) |
+            Q(confirmed=False, valid_until__lt=cutoff))
+
+    def purge(self, retention=None, batch_size=1000, dry_run=False, progress=None):
+        """
+        deletes confirmed and expired actions (see ``purgeable()``) in
+        batches of primary key ranges of ``batch_size``, so that no single
+        DELETE holds its locks for long. Returns the number of deleted
+        actions, with ``dry_run`` only the number of actions which would be
+        deleted.
+
+        ``progress`` is called after each batch with the number of actions
+        deleted so far, the last processed and the highest primary key.
+        """
+        queryset = self.purgeable(retention)
+        if dry_run:
+            return queryset.count()
+
+        def delete_range(low, high):
+            return delete_counted(queryset.filter(pk__gte=low, pk__lt=high))
+
+        return self._in_pk_ranges(delete_range, batch_size, progress)
+
+    def archive(self, retention=None, batch_size=1000, dry_run=False, progress=None):
+        """
+        moves confirmed and expired actions (see ``purgeable()``) to
+        ``ArchivedDeferredAction`` in batches like ``purge()``, so that the
+        live table only holds pending actions. Returns the number of
+        archived actions.
+        """
+        queryset = self.purgeable(retention)
+        if dry_run:
+            return queryset.count()
+
+        fields = [field.attname for field in ArchivedDeferredAction._meta.concrete_fields
+                  if field.attname not in ('id', 'action_id', 'archived_at')]
+
+        def archive_range(low, high):
+            with transaction.atomic():
+                rows = list(queryset.filter(pk__gte=low, pk__lt=high).values('pk', *fields))
+                if not rows:
+                    return 0
+                archived = [ArchivedDeferredAction(action_id=row.pop('pk'), **row)
+                            for row in rows]
+                ArchivedDeferredAction.objects.bulk_create(archived)
+                self.filter(pk__in=[action.action_id for action in archived]).delete()
+            return len(archived)
+
+        return self._in_pk_ranges(archive_range, batch_size, progress)
+
+    def _in_pk_ranges(self, func, batch_size, progress=None):
+        """
+        calls ``func(low, high)`` for consecutive primary key ranges of
+        ``batch_size`` over the whole table and returns the sum of the
+        results. ``progress`` is called after each range with the sum so
+        far, the last processed and the highest primary key.
+        """
+        bounds = self.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            return 0
+
+        done = 0
+        for low in range(bounds['low'], bounds['high'] + 1, batch_size):
+            high = low + batch_size
+            done += func(low, high)
+            if progress is not None:
+                progress(done, min(high, bounds['high'] + 1) - 1, bounds['high'])
+        return done
+
+    def history_for(self, instance):
+        """
+        returns all actions for ``instance``, pending ones as well as
+        confirmed, expired and archived ones, ordered by creation. Archived
+        actions are ``ArchivedDeferredAction`` objects.
+        """
+        ct = content_types.get_for_model(instance)
+        live = list(self.filter(content_type=ct, object_pk=instance.pk))
+        archived = list(ArchivedDeferredAction.objects.filter(
+            content_type=ct, object_pk=force_text(instance.pk)))
+        return sorted(live + archived,
+                      key=lambda action: getattr(action, 'action_id', action.pk))
 
 
 class DeferredAction(models.Model):
-    token = models.CharField(max_length=40)
+    token = models.CharField(max_length=128, unique=True)
     valid_until = models.DateTimeField(null=True)
     confirmed = models.BooleanField(default=False)
+    confirmed_at = models.DateTimeField(null=True, blank=True)
 
     form_class = models.CharField(max_length=255)
-    form_input = PickledObjectField(editable=False)
+    form_input = FormInputField(editable=False)
     form_prefix = models.CharField(max_length=255, blank=True, null=True)
 
     content_type = models.ForeignKey(ContentType, null=True, on_delete=models.CASCADE)
-    object_pk = models.TextField(null=True)
+    object_pk = models.CharField(max_length=255, null=True)
     instance_object = GenericForeignKey('content_type', 'object_pk')
 
     description = models.TextField(blank=True, null=True)
@@ -51,33 +384,56 @@ class DeferredAction(models.Model):
 
     objects = ConfirmationManager()
 
-    def get_resume_form(self):
-        form_class_name = self.form_class
-        dot_index = form_class_name.rindex('.')
-        module = form_class_name[:dot_index]
-        klass = form_class_name[dot_index+1:]
-        form_module = __import__(module, {}, {}, [''])
-        form_class = getattr(form_module, klass)
+    class Meta:
+        # the second index covers pending_for() and superseding
+        index_together = [('confirmed', 'valid_until'),
+                          ('content_type', 'object_pk', 'confirmed', 'valid_until')]
+
+    def get_resume_form(self, instance=None):
+        """
+        returns the deferred form, bound to the stored input. The edited
+        object is fetched unless it is passed as ``instance``.
+        """
+        form_class = registry.get_form_class(self.form_class)
 
-        if self.instance_object is None:
+        if instance is None and self.object_pk is not None:
+            instance = self.get_instance_object()
+
+        if instance is None:
             form = form_class(self.form_input)
         else:
             form = form_class(
-                self.form_input, instance=self.instance_object,
+                self.form_input, instance=instance,
                 prefix=self.form_prefix)
 
         return form
 
-    def resume_form_save(self, commit=True):
-        form = self.get_resume_form()
+    def get_instance_object(self):
+        """
+        returns the edited object like ``instance_object``, but resolves
+        the content type from the app's cache.
+        """
+        if self.content_type_id is None or self.object_pk is None:
+            return None
+        ct = content_types.get_for_id(self.content_type_id)
+        try:
+            return ct.get_object_for_this_type(pk=self.object_pk)
+        except ObjectDoesNotExist:
+            return None
+
+    def resume_form_save(self, commit=True, instance=None):
+        form = self.get_resume_form(instance=instance)
 
-        if not form.is_valid():
+        with metrics.timer('resume.validate'):
+            valid = form.is_valid()
+        if not valid:
             raise Exception(
                 "the defered form was not cleaned properly before saving")
 
-        obj = form.save_original(commit=commit)
-        if commit:
-            obj.save()
+        with metrics.timer('resume.save'):
+            obj = form.save_original(commit=commit)
+            if commit:
+                obj.save()
         return obj
 
     def is_expired(self):
@@ -86,3 +442,37 @@ class DeferredAction(models.Model):
         now = timezone.now()
         return self.valid_until < now
     is_expired.boolean = True
+
+
+class ArchivedDeferredAction(models.Model):
+    """
+    A confirmed or expired DeferredAction, moved out of the live table by
+    ``DeferredAction.objects.archive()``. ``action_id`` is the primary key
+    the action had in the live table.
+
+    """
+    action_id = models.IntegerField(db_index=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    token = models.CharField(max_length=128, db_index=True)
+    valid_until = models.DateTimeField(null=True)
+    confirmed = models.BooleanField(default=False)
+    confirmed_at = models.DateTimeField(null=True, blank=True)
+
+    form_class = models.CharField(max_length=255)
+    form_input = FormInputField(editable=False)
+    form_prefix = models.CharField(max_length=255, blank=True, null=True)
+
+    content_type = models.ForeignKey(ContentType, null=True, on_delete=models.CASCADE)
+    object_pk = models.CharField(max_length=255, null=True)
+    instance_object = GenericForeignKey('content_type', 'object_pk')
+
+    description = models.TextField(blank=True, null=True)
+    user = models.ForeignKey(getattr(settings, 'AUTH_USER_MODEL', 'auth.User'), blank=True, null=True, on_delete=models.CASCADE)
+
+    class Meta:
+        index_together = [('content_type', 'object_pk')]
+
+    def is_expired(self):
+        return not self.confirmed
+    is_expired.boolean = True
@@ -0,0 +1,142 @@
+"""
+Dispatching of the ``send_notification`` method of deferred forms.
+
+By default the notification is sent inline in ``save()``, as before. The
+setting ``GENERIC_CONFIRMATION_NOTIFICATION_BACKEND`` selects another
+backend, e.g. ``generic_confirmation.notifications.ThreadPoolBackend`` to
+send notifications after the transaction was committed and off the request
+thread, so that a slow mail server or sms gateway doesn't delay ``save()``.
+
+Failed notifications are retried ``GENERIC_CONFIRMATION_NOTIFICATION_RETRIES``
+times (default 0), waiting ``GENERIC_CONFIRMATION_NOTIFICATION_RETRY_DELAY``
+seconds in between. If the last attempt fails, the ``notification_failed``
+signal is sent.
+
+To hand notifications to a task queue, subclass ``BaseBackend`` and
+implement ``dispatch()``.
+
+"""
+import time
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.utils.module_loading import import_string
+from generic_confirmation import signals, metrics
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # python 2 without the "futures" backport
+    ThreadPoolExecutor = None
+
+
+class BaseBackend(object):
+    """
+    ``dispatch()`` is called with the form, the user passed to ``save()``
+    and the DeferredAction, and has to arrange for ``run()`` to be called
+    with the same arguments.
+
+    """
+    def dispatch(self, form, user, instance):
+        raise NotImplementedError
+
+    def run(self, form, user, instance):
+        """
+        calls ``form.send_notification``, retrying on errors. Returns True
+        on success, after the last failed attempt ``notification_failed`` is
+        sent and the exception is re-raised.
+        """
+        retries = getattr(settings, 'GENERIC_CONFIRMATION_NOTIFICATION_RETRIES', 0)
+        retry_delay = getattr(settings, 'GENERIC_CONFIRMATION_NOTIFICATION_RETRY_DELAY', 0)
+        attempt = 0
+        while True:
+            try:
+                with metrics.timer('notification.send'):
+                    form.send_notification(user, instance=instance)
+                return True
+            except Exception as e:
+                if attempt >= retries:
+                    metrics.incr('notification.failed')
+                    signals.notification_failed.send(sender=form.__class__,
+                        form=form, instance=instance, exception=e)
+                    raise
+                attempt += 1
+                metrics.incr('notification.retries')
+                if retry_delay:
+                    time.sleep(retry_delay)
+
+
+def on_commit(func):
+    """ runs ``func`` after the current transaction is committed """
+    if hasattr(transaction, 'on_commit'):
+        transaction.on_commit(func)
+    else:
+        # Django < 1.9
+        func()
+
+
+class ImmediateBackend(BaseBackend):
+    """ sends the notification inline, errors are raised from ``save()`` """
+    def dispatch(self, form, user, instance):
+        self.run(form, user, instance)
+
+
+class OnCommitBackend(BaseBackend):
+    """
+    sends the notification in the request thread, but only once the
+    transaction which created the action was committed.
+
+    """
+    def dispatch(self, form, user, instance):
+        on_commit(lambda: self.run_quietly(form, user, instance))
+
+    def run_quietly(self, form, user, instance):
+        # the action is already committed, errors are reported via the
+        # notification_failed signal only
+        try:
+            self.run(form, user, instance)
+        except Exception:
+            pass
+
+
+class ThreadPoolBackend(OnCommitBackend):
+    """
+    sends the notification from a thread pool of
+    ``GENERIC_CONFIRMATION_NOTIFICATION_THREADS`` (default 4) threads, once
+    the transaction which created the action was committed.
+
+    """
+    def __init__(self):
+        if ThreadPoolExecutor is None:
+            raise ImportError("ThreadPoolBackend requires concurrent.futures, "
+                              "install the futures package on python 2.")
+        self.executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'GENERIC_CONFIRMATION_NOTIFICATION_THREADS', 4))
+
+    def dispatch(self, form, user, instance):
+        on_commit(lambda: self.executor.submit(self.run_in_thread, form, user, instance))
+
+    def run_in_thread(self, form, user, instance):
+        try:
+            self.run_quietly(form, user, instance)
+        finally:
+            close_old_connections()
+
+
+_backends = {}
+
+
+def get_backend():
+    """ returns the configured backend instance """
+    path = getattr(settings, 'GENERIC_CONFIRMATION_NOTIFICATION_BACKEND',
+                   'generic_confirmation.notifications.ImmediateBackend')
+    try:
+        return _backends[path]
+    except KeyError:
+        backend = _backends[path] = import_string(path)()
+        return backend
+
+
+def dispatch(form, user, instance):
+    """ dispatches ``form.send_notification`` if the form has one """
+    if hasattr(form, 'send_notification') and callable(form.send_notification):
+        get_backend().dispatch(form, user, instance)
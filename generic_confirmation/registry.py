@@ -0,0 +1,69 @@
+"""
+Process-level registry of the form classes which can be resumed.
+
+``DeferredAction.form_class`` stores the dotted path of the deferred form.
+Resolving the path on every confirmation would run the import machinery each
+time, so resolved classes are cached here. The optional setting
+``GENERIC_CONFIRMATION_FORM_CLASSES`` restricts the paths which may be
+imported, so that a path stored in the database can't import arbitrary
+modules.
+
+"""
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+_registry = {}
+_cache = {}
+
+
+def form_class_name(form_class):
+    """ returns the dotted path under which ``form_class`` is stored """
+    return u"%s.%s" % (form_class.__module__, form_class.__name__)
+
+
+def register(form_class):
+    """
+    registers ``form_class``, registered classes are resumed even if they
+    are not listed in ``GENERIC_CONFIRMATION_FORM_CLASSES``. Can be used as
+    a class decorator.
+    """
+    _registry[form_class_name(form_class)] = form_class
+    return form_class
+
+
+def allowed_form_classes():
+    """ returns the allow-list of dotted paths or None if not restricted """
+    return getattr(settings, 'GENERIC_CONFIRMATION_FORM_CLASSES', None)
+
+
+def get_form_class(path):
+    """
+    returns the form class for the dotted ``path``, importing it only on
+    first use.
+    """
+    try:
+        return _registry[path]
+    except KeyError:
+        pass
+
+    allowed = allowed_form_classes()
+    if allowed is not None and path not in allowed:
+        raise Exception("form class %s is not listed in "
+                        "GENERIC_CONFIRMATION_FORM_CLASSES." % path)
+
+    try:
+        return _cache[path]
+    except KeyError:
+        form_class = _cache[path] = import_string(path)
+        return form_class
+
+
+def load(paths=None):
+    """
+    resolves ``paths`` (defaults to ``GENERIC_CONFIRMATION_FORM_CLASSES``)
+    ahead of time, this is called from ``AppConfig.ready()``.
+    """
+    if paths is None:
+        paths = allowed_form_classes() or ()
+    for path in paths:
+        get_form_class(path)
@@ -0,0 +1,69 @@
+"""
+Serializers for the form input stored with a DeferredAction.
+
+A serializer has a ``dumps(value)`` method returning a string and a
+``loads(data)`` method reversing it. The serializer used by
+``DeferredAction.form_input`` is configured with the setting
+``GENERIC_CONFIRMATION_SERIALIZER`` (a dotted path, default
+``generic_confirmation.serializers.JSONSerializer``).
+
+"""
+import base64
+import json
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.datastructures import MultiValueDict
+from django.utils.encoding import smart_bytes
+from django.utils.module_loading import import_string
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+class JSONSerializer(object):
+    """
+    Stores form input as compact JSON object mapping each key to the list of
+    its values, so multi-value keys of a QueryDict survive the round trip.
+    Values which are not JSON types (dates, decimals, ...) are stored as
+    strings, which is what the form would have received via http anyway.
+
+    """
+    def dumps(self, value):
+        if hasattr(value, 'lists'):
+            items = value.lists()
+        else:
+            items = ((key, list(v) if isinstance(v, (list, tuple)) else [v])
+                     for key, v in value.items())
+        return json.dumps(dict(items), separators=(',', ':'), cls=DjangoJSONEncoder)
+
+    def loads(self, data):
+        return MultiValueDict(json.loads(data))
+
+
+class PickleSerializer(object):
+    """
+    The format used up to version 0.4: base64 encoded pickles. Only use it,
+    if your deferred forms are fed with data which can't be stored as JSON.
+
+    """
+    def dumps(self, value):
+        return base64.b64encode(pickle.dumps(value)).decode()
+
+    def loads(self, data):
+        return pickle.loads(smart_bytes(base64.b64decode(data)))
+
+
+_serializers = {}
+
+
+def get_serializer():
+    """ returns the configured serializer instance """
+    path = getattr(settings, 'GENERIC_CONFIRMATION_SERIALIZER',
+                   'generic_confirmation.serializers.JSONSerializer')
+    try:
+        return _serializers[path]
+    except KeyError:
+        serializer = _serializers[path] = import_string(path)()
+        return serializer
@@ -7,3 +7,23 @@ confirmation_required = Signal(providing_args=["instance", "user"])
 
 # sender is the class which is edited, instance is the DeferedAction instance
 change_confirmed = Signal(providing_args=["instance"])
+
+# sender is the class which is edited, instances is a list of DeferedAction
+# instances created by DeferredForm.bulk_save(), user is the user passed to
+# bulk_save() or None
+confirmations_required = Signal(providing_args=["instances", "user"])
+
+# sender is the deferred form class, form is the form instance, instance is
+# the DeferedAction instance and exception the error raised by the last
+# attempt to call form.send_notification()
+notification_failed = Signal(providing_args=["form", "instance", "exception"])
+
+# sender is the class which is edited, object_pks the primary keys of the
+# edited objects or None if not known, count the number of pending actions
+# expired at once by expire_pending_for() or expire_actions()
+pending_expired = Signal(providing_args=["object_pks", "count"])
+
+# sender is the class which is edited, user the user passed to
+# cancel_for_user() or None, count the number of unconfirmed actions deleted
+# at once by cancel_for_user() or cancel_actions()
+actions_cancelled = Signal(providing_args=["user", "count"])
@@ -1,12 +1,38 @@
+from django import VERSION
 from django.template import Library
 from generic_confirmation.models import DeferredAction
 
 register = Library()
 
+# simple_tag supports "as" since Django 1.9
+if VERSION < (1, 9):
+    assignment_tag = register.assignment_tag
+else:
+    assignment_tag = register.simple_tag
+
+
 @register.simple_tag
-def pending_confirmations(instance):
+def pending_confirmations(instance, counts=None):
     """
     {% load generic_confirmation_tags %}
     Pending: {% pending_confirmations object %}
+
+    If the counts were prefetched with ``prefetch_pending_confirmations``
+    pass them as second argument to avoid a query per object:
+    Pending: {% pending_confirmations object pending_counts %}
     """
+    if counts is not None:
+        return counts.get(instance.pk, 0)
     return DeferredAction.objects.pending_for(instance)
+
+
+@assignment_tag
+def prefetch_pending_confirmations(objects):
+    """
+    {% load generic_confirmation_tags %}
+    {% prefetch_pending_confirmations object_list as pending_counts %}
+    {% for object in object_list %}
+        Pending: {% pending_confirmations object pending_counts %}
+    {% endfor %}
+    """
+    return DeferredAction.objects.pending_counts_for(objects)
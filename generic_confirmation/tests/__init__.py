@@ -1,15 +1,23 @@
 # -*- coding: utf-8 -*-
 """Unit testing for django-generic-confirmation."""
 
+import re
+import json
 import time
+import threading
+from unittest import skipUnless
 from django import VERSION
 from django import forms
 from django.utils import timezone
-from django.test import TestCase, override_settings
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.test.client import Client
 from django.contrib.auth.models import User, Group
-from django.db import models
+from django.contrib.contenttypes.models import ContentType
+from django.db import models, transaction, connection, IntegrityError, OperationalError
 from django.core import mail
+from django.core.management import call_command
+from django.core.cache import cache
 try:
     from django.core.urlresolvers import reverse
 except ImportError:
@@ -17,11 +25,12 @@ except ImportError:
 from django.conf import settings
 from django.template import Template, Context, TemplateDoesNotExist
 from django.http.request import QueryDict
-from generic_confirmation.fields import PickledObjectField
+from generic_confirmation.fields import PickledObjectField, SerializedFormInput
+from generic_confirmation.serializers import JSONSerializer, PickleSerializer
 from generic_confirmation.forms import DeferredForm, ConfirmationForm
-from generic_confirmation.models import DeferredAction
-from generic_confirmation.main import LONG, SHORT, SHORT_UPPER
-from generic_confirmation import signals
+from generic_confirmation.models import DeferredAction, ArchivedDeferredAction
+from generic_confirmation.main import LONG, SHORT, SHORT_UPPER, random_token, sign_token, verify_token
+from generic_confirmation import signals, registry, content_types, metrics, notifications
 
 if VERSION < (1, 9):
     TEST_SERVER_PREFIX = "http://testserver"
@@ -33,17 +42,35 @@ try:
 except NameError:
     _u = str
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 class TokenTestForm(DeferredForm):
     token_format = ('a', 1)
     class Meta:
         model = User
         fields = ('email',)
 
+class RetryTokenTestForm(DeferredForm):
+    tokens = ['a', 'b']
+
+    def _gen_token(self, format=None):
+        return self.tokens.pop(0)
+
+    class Meta:
+        model = User
+        fields = ('email',)
+
 class EmailChangeForm(DeferredForm):
         class Meta:
             model = User
             fields = ('email',)
 
+class SupersedingForm(EmailChangeForm):
+    supersede = True
+
 class GroupNameChangeForm(DeferredForm):
     token_format = SHORT
     class Meta:
@@ -71,6 +98,22 @@ class EmailChangeWithMailForm(DeferredForm):
         model = User
         fields = ('email',)
 
+class FlakyMailForm(DeferredForm):
+    failures = 0
+    sent = threading.Event()
+
+    def send_notification(self, user=None, instance=None):
+        if FlakyMailForm.failures > 0:
+            FlakyMailForm.failures -= 1
+            raise IOError("mail server unavailable")
+        mail.send_mail("please confirm your new address", "Please confirm %s" % instance.token,
+            settings.DEFAULT_FROM_EMAIL, [self.cleaned_data['email'],])
+        FlakyMailForm.sent.set()
+
+    class Meta:
+        model = User
+        fields = ('email',)
+
 class TokenGeneratorTestCase(TestCase):
     def setUp(self):
         self.user1 = User.objects.create_user('userX', 'userX@example.com', '123456')
@@ -87,6 +130,90 @@ class TokenGeneratorTestCase(TestCase):
         # to generate one must fail because it's a not recoverable error for us
         self.assertRaises(Exception, form2.save)
 
+    def testRetryAfterCollision(self):
+        form1 = TokenTestForm({'email': 'xxx@example.com'}, instance=self.user1)
+        self.assertTrue(form1.is_valid())
+        self.assertEquals(form1.save(), 'a')
+
+        # the first generated token collides, the second one is used
+        form2 = RetryTokenTestForm({'email': 'yyy@example.com'}, instance=self.user2)
+        self.assertTrue(form2.is_valid())
+        self.assertEquals(form2.save(), 'b')
+
+    def testRandomToken(self):
+        for format in (LONG, SHORT, SHORT_UPPER):
+            chars, length = format
+            token = random_token(format)
+            self.assertEquals(len(token), length)
+            self.assertTrue(all(c in chars for c in token))
+
+    def testTokenIsUnique(self):
+        form = EmailChangeForm({'email': 'xxx@example.com'}, instance=self.user1)
+        self.assertTrue(form.is_valid())
+        token = form.save()
+        with transaction.atomic():
+            self.assertRaises(IntegrityError, DeferredAction.objects.create,
+                              token=token, form_class='x.Y', form_input={})
+
+class SignedTokenTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user20', 'user20@example.com', '123456')
+
+    def _save(self, valid_until=None):
+        form = EmailChangeForm({'email': 'signed@example.com'}, instance=self.user)
+        form.sign_tokens = True
+        self.assertTrue(form.is_valid())
+        return form.save(valid_until=valid_until)
+
+    def testVerify(self):
+        tomorrow = timezone.now() + timezone.timedelta(days=1)
+        yesterday = timezone.now() - timezone.timedelta(days=1)
+        self.assertEquals(verify_token('plaintoken'), 'unsigned')
+        self.assertEquals(verify_token(sign_token('abc')), 'valid')
+        self.assertEquals(verify_token(sign_token('abc', tomorrow)), 'valid')
+        self.assertEquals(verify_token(sign_token('abc', yesterday)), 'expired')
+        self.assertEquals(verify_token(sign_token('abc') + 'x'), 'bad_signature')
+        self.assertEquals(verify_token('abc.' + sign_token('abd').split('.')[-1]), 'bad_signature')
+
+    def testConfirm(self):
+        token = self._save(valid_until=timezone.now() + timezone.timedelta(days=1))
+        self.assertEquals(verify_token(token), 'valid')
+        self.assertTrue(len(token) <= DeferredAction._meta.get_field('token').max_length)
+        self.assertTrue(DeferredAction.objects.confirm(token))
+        self.assertEquals(User.objects.get(pk=self.user.pk).email, 'signed@example.com')
+
+    @override_settings(GENERIC_CONFIRMATION_SIGN_TOKENS=True)
+    def testSetting(self):
+        self.assertEquals(DeferredAction.objects.confirm_many([self._save()]).popitem()[1], self.user)
+        form = EmailChangeForm({'email': 'bulk@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        token = EmailChangeForm.bulk_save([form])[0]
+        self.assertEquals(verify_token(token), 'valid')
+
+    def testRejectedWithoutQuery(self):
+        token = self._save()
+        expired = sign_token('abc', timezone.now() - timezone.timedelta(seconds=1))
+        with self.assertNumQueries(0):
+            self.assertFalse(ConfirmationForm({'token': token + 'x'}).is_valid())
+            self.assertFalse(ConfirmationForm({'token': expired}).is_valid())
+            self.assertFalse(DeferredAction.objects.confirm(expired))
+            self.assertEquals(DeferredAction.objects.confirm_many([expired]), {expired: False})
+
+    @override_settings(GENERIC_CONFIRMATION_REQUIRE_SIGNED_TOKENS=True)
+    def testRequireSigned(self):
+        form = EmailChangeForm({'email': 'plain@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        plain = form.save()
+        with self.assertNumQueries(0):
+            self.assertFalse(ConfirmationForm({'token': plain}).is_valid())
+        self.assertTrue(ConfirmationForm({'token': self._save()}).is_valid())
+
+    def testUrl(self):
+        token = self._save()
+        self.assertRaises(TemplateDoesNotExist, self.client.get,
+                          reverse('generic_confirmation_by_get', kwargs={'token': token}))
+        self.assertTrue(DeferredAction.objects.get(token=token).confirmed)
+
 class DeferFormTestCase(TestCase):
     def setUp(self):
         self.user = User.objects.create_user('user1', 'user1@example.com', '123456')
@@ -176,6 +303,26 @@ class DeferFormTestCase(TestCase):
         confirm_form = ConfirmationForm({'token': 'some-bogus-token-2'})
         self.assertFalse(confirm_form.is_valid())
 
+    def testConfirmExpiredViaForm(self):
+        form = EmailChangeForm({'email': 'xxx@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        defered = form.save(valid_until=timezone.now() - timezone.timedelta(hours=1))
+
+        confirm_form = ConfirmationForm({'token': defered})
+        self.assertFalse(confirm_form.is_valid())
+
+    def testConfirmTwiceViaForm(self):
+        form = EmailChangeForm({'email': 'xxx@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        defered = form.save()
+
+        confirm_form = ConfirmationForm({'token': defered})
+        self.assertTrue(confirm_form.is_valid())
+        self.assertTrue(confirm_form.save())
+
+        confirm_form = ConfirmationForm({'token': defered})
+        self.assertFalse(confirm_form.is_valid())
+
 
     def testCustomValidUntil(self):
         # very similar to self.testEmailChange
@@ -227,6 +374,280 @@ class DeferFormTestCase(TestCase):
         self.assertEquals(action.user, self.user)
 
 
+class BulkSaveTestCase(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user('bulk%d' % i, 'bulk%d@example.com' % i, '123456')
+                      for i in range(5)]
+
+    def _forms(self):
+        forms = [EmailChangeForm({'email': 'new%d@example.com' % i}, instance=user)
+                 for i, user in enumerate(self.users)]
+        for form in forms:
+            self.assertTrue(form.is_valid())
+        return forms
+
+    def testBulkSave(self):
+        tokens = EmailChangeForm.bulk_save(self._forms(), batch_size=2)
+        self.assertEquals(len(tokens), 5)
+        self.assertEquals(len(set(tokens)), 5)
+        self.assertEquals(DeferredAction.objects.count(), 5)
+
+        # nothing changed yet
+        user_obj = User.objects.get(pk=self.users[3].pk)
+        self.assertEquals(user_obj.email, 'bulk3@example.com')
+
+        self.assertTrue(DeferredAction.objects.confirm(tokens[3]))
+        user_obj = User.objects.get(pk=self.users[3].pk)
+        self.assertEquals(user_obj.email, 'new3@example.com')
+
+    def testBulkSaveSignal(self):
+        received = []
+
+        def dummy_listener(sender, instances, user, **kwargs):
+            received.append((sender, instances, user))
+
+        def single_listener(sender, instance, **kwargs):
+            self.fail("confirmation_required must not be sent by bulk_save")
+
+        signals.confirmations_required.connect(dummy_listener)
+        signals.confirmation_required.connect(single_listener)
+        try:
+            tokens = EmailChangeForm.bulk_save(self._forms(), user=self.users[0])
+        finally:
+            signals.confirmations_required.disconnect(dummy_listener)
+            signals.confirmation_required.disconnect(single_listener)
+
+        self.assertEquals(len(received), 1)
+        sender, instances, user = received[0]
+        self.assertEquals(sender, User)
+        self.assertEquals(user, self.users[0])
+        self.assertEquals([instance.token for instance in instances], tokens)
+
+    def testBulkSaveInvalidForm(self):
+        forms = self._forms() + [EmailChangeForm({'email': 'invalid'}, instance=self.users[0])]
+        self.assertRaises(Exception, EmailChangeForm.bulk_save, forms)
+        self.assertEquals(DeferredAction.objects.count(), 0)
+
+    def testBulkSaveCollision(self):
+        forms = [TokenTestForm({'email': 'xxx@example.com'}, instance=user)
+                 for user in self.users[:2]]
+        for form in forms:
+            self.assertTrue(form.is_valid())
+        # the token format only allows one possible token
+        self.assertRaises(Exception, TokenTestForm.bulk_save, forms)
+
+
+class ConfirmManyTestCase(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user('many%d' % i, 'many%d@example.com' % i, '123456')
+                      for i in range(3)]
+        self.group = Group.objects.create(name='many_group')
+        ContentType.objects.get_for_model(User)
+        ContentType.objects.get_for_model(Group)
+
+    def _defer(self, form, **kwargs):
+        self.assertTrue(form.is_valid())
+        return form.save(**kwargs)
+
+    def testConfirmMany(self):
+        tokens = [self._defer(EmailChangeForm({'email': 'new%d@example.com' % i}, instance=user))
+                  for i, user in enumerate(self.users)]
+        tokens.append(self._defer(GroupNameChangeForm({'name': 'renamed'}, instance=self.group)))
+        tokens.append(self._defer(UserCreateForm({'username': 'many9', 'email': 'many9@example.com',
+                                                  'password': '123456'})))
+        expired = self._defer(EmailChangeForm({'email': 'expired@example.com'}, instance=self.users[0]),
+                              valid_until=timezone.now() - timezone.timedelta(hours=1))
+
+        results = DeferredAction.objects.confirm_many(tokens + [expired, 'some-bogus-token-5'])
+
+        self.assertEquals(results[expired], False)
+        self.assertEquals(results['some-bogus-token-5'], False)
+        for i, user in enumerate(self.users):
+            self.assertEquals(results[tokens[i]], user)
+            self.assertEquals(User.objects.get(pk=user.pk).email, 'new%d@example.com' % i)
+        self.assertEquals(Group.objects.get(pk=self.group.pk).name, 'renamed')
+        self.assertEquals(results[tokens[4]], User.objects.get(username='many9'))
+
+        # confirmed actions can't be confirmed again
+        self.assertEquals(DeferredAction.objects.confirm_many(tokens),
+                          dict((token, False) for token in tokens))
+
+    def testQueryCount(self):
+        tokens = [self._defer(EmailChangeForm({'email': 'new%d@example.com' % i}, instance=user))
+                  for i, user in enumerate(self.users)]
+
+        # SELECT actions, SELECT users and per action SAVEPOINT,
+        # UPDATE action, UPDATE user (twice), RELEASE SAVEPOINT
+        with self.assertNumQueries(2 + 3 * 5):
+            DeferredAction.objects.confirm_many(tokens)
+
+
+class ConcurrentConfirmTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user12', 'user12@example.com', '123456')
+
+    def testOnlyOneConfirmWins(self):
+        if connection.vendor == 'sqlite' and connection.settings_dict['NAME'] == ':memory:':
+            # without shared cache support (Django 1.8 on python 2) every
+            # thread gets its own empty in-memory database
+            self.skipTest("the test database can't be shared between threads")
+        form = EmailChangeForm({'email': 'xxx@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        token = form.save()
+
+        start = threading.Event()
+        results = []
+        errors = []
+
+        def confirm():
+            start.wait()
+            try:
+                results.append(DeferredAction.objects.confirm(token))
+            except OperationalError as e:
+                if 'is locked' in str(e):
+                    # sqlite's shared cache in-memory database reports
+                    # concurrent writes as "table is locked" instead of waiting
+                    results.append(False)
+                else:
+                    errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=confirm) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(errors, [])
+        self.assertEquals(len(results), 10)
+        self.assertEquals(len([result for result in results if result]), 1)
+        self.assertTrue(DeferredAction.objects.get(token=token).confirmed)
+
+    def testFailedResumeIsNotConfirmed(self):
+        form = GroupChangeForm({'groups': [Group.objects.create(name='group12').pk]},
+                               instance=self.user)
+        self.assertTrue(form.is_valid())
+        token = form.save()
+        Group.objects.all().delete()
+
+        # the form can't be resumed, because the group is gone
+        self.assertRaises(Exception, DeferredAction.objects.confirm, token)
+        self.assertFalse(DeferredAction.objects.get(token=token).confirmed)
+
+
+class QueryCountTestCase(TestCase):
+    """
+    pins the number of queries of the hot paths, the content type cache is
+    warmed up in setUp, so these are the numbers of a running process.
+
+    """
+    def setUp(self):
+        self.user = User.objects.create_user('user10', 'user10@example.com', '123456')
+        content_types.get_for_model(User)
+        # the app's cache doesn't depend on django's content type cache
+        ContentType.objects.clear_cache()
+
+    def testSave(self):
+        form = EmailChangeForm({'email': 'xxx@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        # SAVEPOINT, INSERT, RELEASE SAVEPOINT
+        with self.assertNumQueries(3):
+            form.save()
+
+    def testSaveCreateForm(self):
+        form = UserCreateForm({'username': 'user11', 'email': 'user11@example.com', 'password': '123456'})
+        self.assertTrue(form.is_valid())
+        with self.assertNumQueries(3):
+            form.save()
+
+    def testConfirm(self):
+        form = EmailChangeForm({'email': 'xxx@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        token = form.save()
+        # SELECT action, SAVEPOINT, UPDATE action, SELECT user,
+        # UPDATE user (twice), RELEASE SAVEPOINT
+        with self.assertNumQueries(7):
+            self.assertTrue(DeferredAction.objects.confirm(token))
+
+    def testConfirmationForm(self):
+        form = EmailChangeForm({'email': 'xxx@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        token = form.save()
+        # the action is loaded once by clean_token and reused by save()
+        with self.assertNumQueries(7):
+            confirm_form = ConfirmationForm({'token': token})
+            self.assertTrue(confirm_form.is_valid())
+            self.assertTrue(confirm_form.save())
+
+    def testPendingFor(self):
+        form = EmailChangeForm({'email': 'xxx@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        form.save()
+        with self.assertNumQueries(1):
+            self.assertEquals(DeferredAction.objects.pending_for(self.user), 1)
+
+    def testNoContentTypeQueries(self):
+        content_types.clear()
+        ContentType.objects.clear_cache()
+        content_types.load()
+
+        with CaptureQueriesContext(connection) as queries:
+            form = EmailChangeForm({'email': 'xxx@example.com'}, instance=self.user)
+            self.assertTrue(form.is_valid())
+            token = form.save()
+            DeferredAction.objects.pending_for(self.user)
+            DeferredAction.objects.pending_counts_for([self.user])
+            DeferredAction.objects.confirm(token)
+            form = EmailChangeForm({'email': 'yyy@example.com'}, instance=self.user)
+            self.assertTrue(form.is_valid())
+            DeferredAction.objects.confirm_many([form.save()])
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'django_content_type' in query['sql']])
+
+
+class FormRegistryTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user13', 'user13@example.com', '123456')
+        self._registry = registry._registry.copy()
+        self._cache = registry._cache.copy()
+        registry._registry.clear()
+        registry._cache.clear()
+
+    def tearDown(self):
+        registry._registry.clear()
+        registry._registry.update(self._registry)
+        registry._cache.clear()
+        registry._cache.update(self._cache)
+
+    def testCachedLookup(self):
+        path = 'generic_confirmation.tests.EmailChangeForm'
+        self.assertEquals(registry.get_form_class(path), EmailChangeForm)
+        self.assertEquals(registry._cache, {path: EmailChangeForm})
+        self.assertEquals(registry.get_form_class(path), EmailChangeForm)
+
+    def testLoad(self):
+        registry.load(['generic_confirmation.tests.EmailChangeForm',
+                       'generic_confirmation.tests.UserCreateForm'])
+        self.assertEquals(set(registry._cache),
+                          set(['generic_confirmation.tests.EmailChangeForm',
+                               'generic_confirmation.tests.UserCreateForm']))
+
+    @override_settings(GENERIC_CONFIRMATION_FORM_CLASSES=['generic_confirmation.tests.UserCreateForm'])
+    def testAllowList(self):
+        form = EmailChangeForm({'email': 'xxx@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        token = form.save()
+        self.assertRaises(Exception, DeferredAction.objects.confirm, token)
+        self.assertRaises(Exception, registry.get_form_class, 'os.system')
+        self.assertEquals(registry._cache, {})
+
+        # explicitly registered classes don't need to be listed
+        registry.register(EmailChangeForm)
+        self.assertTrue(DeferredAction.objects.confirm(token))
+
+
 class ManyToManyTestCase(TestCase):
     def setUp(self):
         self.user = User.objects.create_user('user3', 'user3@example.com', '123456')
@@ -362,6 +783,160 @@ class NotificationTestCase(TestCase):
         self.assertTrue(token in mail.outbox[0].body)
 
 
+class NotificationBackendTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user17', 'user17@example.com', '123456')
+        FlakyMailForm.failures = 0
+        FlakyMailForm.sent.clear()
+
+    def _save(self):
+        form = FlakyMailForm({'email': 'new@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        return form.save(self.user)
+
+    @override_settings(GENERIC_CONFIRMATION_NOTIFICATION_RETRIES=2)
+    def testRetry(self):
+        FlakyMailForm.failures = 2
+        token = self._save()
+        self.assertEquals(len(mail.outbox), 1)
+        self.assertTrue(token in mail.outbox[0].body)
+
+    def testFailure(self):
+        failed = []
+
+        def dummy_listener(sender, form, instance, exception, **kwargs):
+            failed.append((sender, instance, exception))
+
+        signals.notification_failed.connect(dummy_listener)
+        FlakyMailForm.failures = 1
+        try:
+            self.assertRaises(IOError, self._save)
+        finally:
+            signals.notification_failed.disconnect(dummy_listener)
+        self.assertEquals(len(failed), 1)
+        self.assertEquals(failed[0][0], FlakyMailForm)
+        self.assertTrue(isinstance(failed[0][2], IOError))
+        self.assertEquals(len(mail.outbox), 0)
+
+    @skipUnless(hasattr(transaction, 'on_commit'), "transaction.on_commit() was added in Django 1.9")
+    @override_settings(GENERIC_CONFIRMATION_NOTIFICATION_BACKEND='generic_confirmation.notifications.OnCommitBackend')
+    def testOnCommitInTransaction(self):
+        # TestCase never commits, so the notification is never sent
+        self._save()
+        self.assertEquals(len(mail.outbox), 0)
+
+
+class NotificationThreadTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user18', 'user18@example.com', '123456')
+        FlakyMailForm.failures = 0
+        FlakyMailForm.sent.clear()
+
+    def _save(self):
+        form = FlakyMailForm({'email': 'new@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        return form.save(self.user)
+
+    @skipUnless(hasattr(transaction, 'on_commit'), "transaction.on_commit() was added in Django 1.9")
+    @override_settings(GENERIC_CONFIRMATION_NOTIFICATION_BACKEND='generic_confirmation.notifications.OnCommitBackend')
+    def testOnCommit(self):
+        with transaction.atomic():
+            token = self._save()
+            self.assertEquals(len(mail.outbox), 0)
+        self.assertEquals(len(mail.outbox), 1)
+        self.assertTrue(token in mail.outbox[0].body)
+
+    @skipUnless(notifications.ThreadPoolExecutor is not None, "the futures backport isn't installed")
+    @override_settings(GENERIC_CONFIRMATION_NOTIFICATION_BACKEND='generic_confirmation.notifications.ThreadPoolBackend')
+    def testThreadPool(self):
+        token = self._save()
+        self.assertTrue(FlakyMailForm.sent.wait(5))
+        self.assertEquals(len(mail.outbox), 1)
+        self.assertTrue(token in mail.outbox[0].body)
+
+    @skipUnless(notifications.ThreadPoolExecutor is not None, "the futures backport isn't installed")
+    @override_settings(GENERIC_CONFIRMATION_NOTIFICATION_BACKEND='generic_confirmation.notifications.ThreadPoolBackend')
+    def testThreadPoolFailure(self):
+        failed = threading.Event()
+
+        def dummy_listener(sender, form, instance, exception, **kwargs):
+            failed.set()
+
+        signals.notification_failed.connect(dummy_listener)
+        FlakyMailForm.failures = 1
+        try:
+            # the error isn't raised from save()
+            self._save()
+            self.assertTrue(failed.wait(5))
+        finally:
+            signals.notification_failed.disconnect(dummy_listener)
+        self.assertEquals(len(mail.outbox), 0)
+
+
+@override_settings(GENERIC_CONFIRMATION_METRICS_BACKEND='generic_confirmation.metrics.MemoryBackend')
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user19', 'user19@example.com', '123456')
+        self.backend = metrics.get_backend()
+        self.backend.reset()
+
+    def _save(self, form_class=EmailChangeForm, **kwargs):
+        form = form_class({'email': 'new@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        return form.save(**kwargs)
+
+    def testNullBackend(self):
+        with self.settings(GENERIC_CONFIRMATION_METRICS_BACKEND='generic_confirmation.metrics.NullBackend'):
+            self.assertTrue(isinstance(metrics.get_backend(), metrics.NullBackend))
+            self.assertTrue(DeferredAction.objects.confirm(self._save()))
+        self.assertEquals(self.backend.counters, {})
+
+    def testSave(self):
+        self._save()
+        self.assertEquals(self.backend.counters, {'token.attempts': 1})
+        self.assertEquals(len(self.backend.timings['action.insert']), 1)
+        self.assertEquals(len(self.backend.timings['signal.confirmation_required']), 1)
+
+    def testCollision(self):
+        for tokens in (['a'], ['a', 'b']):
+            form = RetryTokenTestForm({'email': 'new@example.com'}, instance=self.user)
+            form.tokens = tokens
+            self.assertTrue(form.is_valid())
+            form.save()
+        self.assertEquals(self.backend.counters,
+                          {'token.attempts': 3, 'token.collisions': 1})
+
+    def testConfirmOutcomes(self):
+        token = self._save()
+        expired = self._save(valid_until=timezone.now() - timezone.timedelta(days=1))
+        self.assertTrue(DeferredAction.objects.confirm(token))
+        self.assertFalse(DeferredAction.objects.confirm(token))
+        self.assertFalse(DeferredAction.objects.confirm(expired))
+        self.assertFalse(DeferredAction.objects.confirm('unknown'))
+        self.assertFalse(ConfirmationForm({'token': 'unknown'}).is_valid())
+        counters = self.backend.counters
+        self.assertEquals(counters['confirm.success'], 1)
+        self.assertEquals(counters['confirm.already_confirmed'], 1)
+        self.assertEquals(counters['confirm.expired'], 1)
+        self.assertEquals(counters['confirm.unknown'], 2)
+        for name in ('resume.validate', 'resume.save', 'signal.change_confirmed'):
+            self.assertEquals(len(self.backend.timings[name]), 1)
+
+    def testConfirmMany(self):
+        token = self._save()
+        DeferredAction.objects.confirm_many([token, 'unknown'])
+        self.assertEquals(self.backend.counters['confirm.success'], 1)
+        self.assertEquals(self.backend.counters['confirm.unknown'], 1)
+
+    @override_settings(GENERIC_CONFIRMATION_NOTIFICATION_RETRIES=1)
+    def testNotification(self):
+        FlakyMailForm.failures = 2
+        self.assertRaises(IOError, self._save, FlakyMailForm)
+        self.assertEquals(self.backend.counters['notification.retries'], 1)
+        self.assertEquals(self.backend.counters['notification.failed'], 1)
+        self.assertEquals(len(self.backend.timings['notification.send']), 2)
+
+
 class TemplatetagTestCase(TestCase):
     def setUp(self):
         self.user5 = User.objects.create_user('user5', 'user5@example.com', '123456')
@@ -399,6 +974,535 @@ class TemplatetagTestCase(TestCase):
         self.assertEquals(html, "0")
 
 
+class PurgeableActionsMixIn(object):
+    def setUp(self):
+        self.user = User.objects.create_user('user15', 'user15@example.com', '123456')
+        now = timezone.now()
+        self.pending = self._defer()
+        self.pending_with_date = self._defer(valid_until=now + timezone.timedelta(days=1))
+        self.expired = self._defer(valid_until=now - timezone.timedelta(days=1))
+        self.expired_long_ago = self._defer(valid_until=now - timezone.timedelta(days=10))
+        self.confirmed = self._defer()
+        DeferredAction.objects.confirm(self.confirmed)
+        self.confirmed_long_ago = self._defer()
+        DeferredAction.objects.confirm(self.confirmed_long_ago)
+        DeferredAction.objects.filter(token=self.confirmed_long_ago).update(
+            confirmed_at=now - timezone.timedelta(days=10))
+
+    def _defer(self, **kwargs):
+        form = EmailChangeForm({'email': 'xxx@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        return form.save(**kwargs)
+
+    def _remaining(self):
+        return set(DeferredAction.objects.values_list('token', flat=True))
+
+
+class PurgeTestCase(PurgeableActionsMixIn, TestCase):
+    def testPurge(self):
+        self.assertEquals(DeferredAction.objects.purge(batch_size=2), 4)
+        self.assertEquals(self._remaining(), set([self.pending, self.pending_with_date]))
+
+    def testRetention(self):
+        self.assertEquals(DeferredAction.objects.purge(
+            retention=timezone.timedelta(days=5)), 2)
+        self.assertEquals(self._remaining(), set([self.pending, self.pending_with_date,
+                                                  self.expired, self.confirmed]))
+
+    def testDryRun(self):
+        self.assertEquals(DeferredAction.objects.purge(dry_run=True), 4)
+        self.assertEquals(DeferredAction.objects.count(), 6)
+
+    def testProgress(self):
+        calls = []
+        max_pk = DeferredAction.objects.latest('pk').pk
+        DeferredAction.objects.purge(batch_size=4, progress=lambda *args: calls.append(args))
+        self.assertEquals(len(calls), 2)
+        self.assertEquals(calls[-1], (4, max_pk, max_pk))
+
+    def testCommand(self):
+        out = StringIO()
+        call_command('purge_deferred_actions', dry_run=True, stdout=out)
+        self.assertEquals(out.getvalue(), "4 actions would be deleted.\n")
+
+        out = StringIO()
+        call_command('purge_deferred_actions', days=5, batch_size=2, verbosity=0, stdout=out)
+        self.assertEquals(out.getvalue(), "2 actions deleted.\n")
+        self.assertEquals(DeferredAction.objects.count(), 4)
+
+
+class ArchiveTestCase(PurgeableActionsMixIn, TestCase):
+    def testArchive(self):
+        expired = DeferredAction.objects.get(token=self.expired)
+        self.assertEquals(DeferredAction.objects.archive(batch_size=2), 4)
+        self.assertEquals(self._remaining(), set([self.pending, self.pending_with_date]))
+        self.assertEquals(set(ArchivedDeferredAction.objects.values_list('token', flat=True)),
+                          set([self.expired, self.expired_long_ago,
+                               self.confirmed, self.confirmed_long_ago]))
+        archived = ArchivedDeferredAction.objects.get(token=self.expired)
+        self.assertEquals(archived.action_id, expired.pk)
+        self.assertEquals(archived.valid_until, expired.valid_until)
+        self.assertEquals(archived.form_input, expired.form_input)
+        self.assertEquals(archived.instance_object, self.user)
+        self.assertTrue(archived.is_expired())
+        self.assertTrue(archived.archived_at is not None)
+
+    def testLiveTableOnly(self):
+        DeferredAction.objects.archive()
+        self.assertFalse(DeferredAction.objects.confirm(self.confirmed))
+        self.assertEquals(DeferredAction.objects.pending_for(self.user), 2)
+        self.assertTrue(DeferredAction.objects.confirm(self.pending))
+
+    def testHistory(self):
+        DeferredAction.objects.archive(retention=timezone.timedelta(days=5))
+        history = DeferredAction.objects.history_for(self.user)
+        self.assertEquals([action.token for action in history], [
+            self.pending, self.pending_with_date, self.expired,
+            self.expired_long_ago, self.confirmed, self.confirmed_long_ago])
+        self.assertEquals([action.__class__ for action in history],
+                          [DeferredAction] * 3 + [ArchivedDeferredAction,
+                           DeferredAction, ArchivedDeferredAction])
+
+    def testCommand(self):
+        out = StringIO()
+        call_command('archive_deferred_actions', dry_run=True, stdout=out)
+        self.assertEquals(out.getvalue(), "4 actions would be archived.\n")
+
+        out = StringIO()
+        call_command('archive_deferred_actions', days=5, batch_size=2, verbosity=0, stdout=out)
+        self.assertEquals(out.getvalue(), "2 actions archived.\n")
+        self.assertEquals(DeferredAction.objects.count(), 4)
+        self.assertEquals(ArchivedDeferredAction.objects.count(), 2)
+
+
+@override_settings(GENERIC_CONFIRMATION_THROTTLE_CACHE='default',
+                   GENERIC_CONFIRMATION_THROTTLE_LIMIT=3)
+class ThrottleTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user21', 'user21@example.com', '123456')
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def _defer(self):
+        form = EmailChangeForm({'email': 'xxx@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        return form.save()
+
+    def testNegativeCache(self):
+        with self.assertNumQueries(1):
+            self.assertFalse(ConfirmationForm({'token': 'unknown'}).is_valid())
+        with self.assertNumQueries(0):
+            self.assertFalse(ConfirmationForm({'token': 'unknown'}).is_valid())
+
+    def testPrefixThrottle(self):
+        token = self._defer()
+        for guess in ('aaa', 'aab', 'aac'):
+            self.assertFalse(ConfirmationForm({'token': token[:2] + guess}).is_valid())
+        with self.assertNumQueries(0):
+            form = ConfirmationForm({'token': token})
+            self.assertFalse(form.is_valid())
+        self.assertTrue('too many attempts' in form.errors['token'][0])
+        # other prefixes are still looked up
+        other = '22' if token[:2] != '22' else '33'
+        with self.assertNumQueries(1):
+            self.assertFalse(ConfirmationForm({'token': other + token[2:]}).is_valid())
+
+    def testIpThrottle(self):
+        url = reverse('generic_confirmation_by_form')
+        for guess in ('aaa', 'bbb', 'ccc'):
+            self.assertRaises(TemplateDoesNotExist, self.client.post, url, {'token': guess})
+        token = self._defer()
+        with self.assertNumQueries(0):
+            self.assertRaises(TemplateDoesNotExist, self.client.post, url, {'token': token})
+            self.assertRaises(TemplateDoesNotExist, self.client.get,
+                              reverse('generic_confirmation_by_get', kwargs={'token': token}))
+        self.assertFalse(DeferredAction.objects.get(token=token).confirmed)
+        # another client can still confirm
+        self.assertRaises(TemplateDoesNotExist, self.client.get,
+                          reverse('generic_confirmation_by_get', kwargs={'token': token}),
+                          REMOTE_ADDR='10.0.0.1')
+        self.assertTrue(DeferredAction.objects.get(token=token).confirmed)
+
+    @override_settings(GENERIC_CONFIRMATION_THROTTLE_CACHE=None)
+    def testDisabled(self):
+        for i in range(5):
+            with self.assertNumQueries(1):
+                self.assertFalse(ConfirmationForm({'token': 'unknown'}).is_valid())
+
+
+@override_settings(GENERIC_CONFIRMATION_PENDING_CACHE='default')
+class PendingCacheTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user16', 'user16@example.com', '123456')
+        ContentType.objects.get_for_model(User)
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def _defer(self, **kwargs):
+        form = EmailChangeForm({'email': 'xxx@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        return form.save(**kwargs)
+
+    def testCached(self):
+        self._defer()
+        with self.assertNumQueries(1):
+            self.assertEquals(DeferredAction.objects.pending_for(self.user), 1)
+        with self.assertNumQueries(0):
+            self.assertEquals(DeferredAction.objects.pending_for(self.user), 1)
+
+    def testDeferAndConfirm(self):
+        self.assertEquals(DeferredAction.objects.pending_for(self.user), 0)
+        token = self._defer()
+        self.assertEquals(DeferredAction.objects.pending_for(self.user), 1)
+        self._defer()
+        self.assertEquals(DeferredAction.objects.pending_for(self.user), 2)
+        DeferredAction.objects.confirm(token)
+        self.assertEquals(DeferredAction.objects.pending_for(self.user), 1)
+
+    def testBulkSave(self):
+        self.assertEquals(DeferredAction.objects.pending_for(self.user), 0)
+        form = EmailChangeForm({'email': 'xxx@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        EmailChangeForm.bulk_save([form])
+        self.assertEquals(DeferredAction.objects.pending_for(self.user), 1)
+
+    def testExpiry(self):
+        self._defer(valid_until=timezone.now() + timezone.timedelta(seconds=1))
+        self.assertEquals(DeferredAction.objects.pending_for(self.user), 1)
+        time.sleep(1.1)
+        self.assertEquals(DeferredAction.objects.pending_for(self.user), 0)
+
+
+class PendingCountsTestCase(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user('counts%d' % i, 'counts%d@example.com' % i, '123456')
+                      for i in range(3)]
+        ContentType.objects.get_for_model(User)
+        for user, pending in zip(self.users, (1, 0, 2)):
+            for i in range(pending):
+                form = EmailChangeForm({'email': 'new%d@example.com' % i}, instance=user)
+                self.assertTrue(form.is_valid())
+                form.save()
+        # neither confirmed nor expired actions are pending
+        form = EmailChangeForm({'email': 'expired@example.com'}, instance=self.users[1])
+        self.assertTrue(form.is_valid())
+        form.save(valid_until=timezone.now() - timezone.timedelta(hours=1))
+        form = EmailChangeForm({'email': 'confirmed@example.com'}, instance=self.users[1])
+        self.assertTrue(form.is_valid())
+        DeferredAction.objects.filter(token=form.save()).update(confirmed=True)
+
+    def testPendingCountsFor(self):
+        with self.assertNumQueries(1):
+            counts = DeferredAction.objects.pending_counts_for(self.users)
+        self.assertEquals(counts, {self.users[0].pk: 1, self.users[1].pk: 0, self.users[2].pk: 2})
+        for user in self.users:
+            self.assertEquals(counts[user.pk], DeferredAction.objects.pending_for(user))
+
+    def testPendingCountsForQueryset(self):
+        users = User.objects.filter(username__startswith='counts').order_by('pk')
+        # one query for the users, one for the counts
+        with self.assertNumQueries(2):
+            counts = DeferredAction.objects.pending_counts_for(users)
+        self.assertEquals(sorted(counts.values()), [0, 1, 2])
+        self.assertEquals(DeferredAction.objects.pending_counts_for([]), {})
+
+    def testTemplatetag(self):
+        users = list(User.objects.filter(username__startswith='counts').order_by('pk'))
+        t = Template("""{% load generic_confirmation_tags %}"""
+                     """{% prefetch_pending_confirmations users as pending %}"""
+                     """{% for user in users %}{% pending_confirmations user pending %},{% endfor %}""")
+        with self.assertNumQueries(1):
+            html = t.render(Context({'users': users}))
+        self.assertEquals(html, "1,0,2,")
+
+
+class AdminTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('user22', 'user22@example.com', '123456')
+        self.client.login(username='user22', password='123456')
+        now = timezone.now()
+        self.pending = self._defer(valid_until=now + timezone.timedelta(days=1))
+        self.expired = self._defer(valid_until=now - timezone.timedelta(days=1))
+        self.confirmed = self._defer()
+        DeferredAction.objects.confirm(self.confirmed)
+
+    def _defer(self, **kwargs):
+        form = EmailChangeForm({'email': 'xxx@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        return form.save(**kwargs)
+
+    def _changelist(self, query=''):
+        url = reverse('admin:generic_confirmation_deferredaction_changelist') + query
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        return response, queries
+
+    def testStatus(self):
+        response, queries = self._changelist()
+        statuses = dict((action.token, action.status)
+                        for action in response.context['cl'].result_list)
+        self.assertEquals(statuses, {self.pending: 'pending', self.expired: 'expired',
+                                     self.confirmed: 'confirmed'})
+        self.assertFalse(any('form_input' in query['sql'] for query in queries))
+
+    def testFilters(self):
+        for status, token in (('pending', self.pending), ('expired', self.expired),
+                              ('confirmed', self.confirmed)):
+            response, queries = self._changelist('?status=%s' % status)
+            self.assertEquals([action.token for action in response.context['cl'].result_list],
+                              [token])
+        ct = ContentType.objects.get_for_model(User)
+        response, queries = self._changelist('?content_type__id__exact=%d' % ct.pk)
+        self.assertEquals(len(response.context['cl'].result_list), 3)
+
+    def testNoFullCount(self):
+        response, queries = self._changelist('?status=pending')
+        counts = [query['sql'] for query in queries
+                  if 'COUNT' in query['sql'] and 'deferredaction' in query['sql']]
+        self.assertEquals(len(counts), 1)
+
+
+class SupersedeTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user27', 'user27@example.com', '123456')
+
+    def _defer(self, email, form_class=EmailChangeForm, **kwargs):
+        form = form_class({'email': email, 'username': 'user27'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        return form.save(**kwargs)
+
+    def testSupersede(self):
+        first = self._defer('first@example.com')
+        second = self._defer('second@example.com', supersede=True)
+        self.assertEquals(DeferredAction.objects.pending_for(self.user), 1)
+        self.assertFalse(DeferredAction.objects.confirm(first))
+        self.assertTrue(DeferredAction.objects.confirm(second))
+        self.assertEquals(User.objects.get(pk=self.user.pk).email, 'second@example.com')
+
+    def testFormAttribute(self):
+        self._defer('first@example.com', SupersedingForm)
+        # savepoints, UPDATE and INSERT
+        with self.assertNumQueries(6):
+            self._defer('second@example.com', SupersedingForm)
+        self.assertEquals(DeferredAction.objects.pending_for(self.user), 1)
+        # the form attribute can be overridden per call
+        self._defer('third@example.com', SupersedingForm, supersede=False)
+        self.assertEquals(DeferredAction.objects.pending_for(self.user), 2)
+
+    def testOtherFormsNotSuperseded(self):
+        self._defer('first@example.com', EmailChangeWithMailForm)
+        self._defer('second@example.com', supersede=True)
+        self.assertEquals(DeferredAction.objects.pending_for(self.user), 2)
+
+    def testSupersededWhileConfirming(self):
+        first = self._defer('first@example.com')
+        confirmation = ConfirmationForm({'token': first})
+        self.assertTrue(confirmation.is_valid())
+        # a new request lands between clean_token() and save()
+        second = self._defer('second@example.com', supersede=True)
+        self.assertFalse(confirmation.save())
+        self.assertEquals(User.objects.get(pk=self.user.pk).email, 'user27@example.com')
+        self.assertFalse(DeferredAction.objects.get(token=first).confirmed)
+        self.assertTrue(DeferredAction.objects.confirm(second))
+
+    def testSignal(self):
+        received = []
+
+        def receiver(sender, object_pks, count, **kwargs):
+            received.append((sender, object_pks, count))
+
+        signals.pending_expired.connect(receiver)
+        try:
+            self._defer('first@example.com')
+            self._defer('second@example.com', supersede=True)
+        finally:
+            signals.pending_expired.disconnect(receiver)
+        self.assertEquals(received, [(User, [self.user.pk], 1)])
+
+
+class IndexTestCase(TestCase):
+    """
+    checks with EXPLAIN that the lookups per object use an index. The test
+    settings disable migrations, so this sees the indexes of the model's
+    index_together, not anything only a migration creates.
+
+    """
+    def setUp(self):
+        self.user = User.objects.create_user('user28', 'user28@example.com', '123456')
+        form = EmailChangeForm({'email': 'xxx@example.com'}, instance=self.user)
+        self.assertTrue(form.is_valid())
+        form.save()
+
+    def _plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                return ' '.join(row[-1] for row in cursor.fetchall())
+            if connection.vendor == 'postgresql':
+                # the test table is tiny, a sequential scan would always win
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql, params)
+                return ' '.join(row[0] for row in cursor.fetchall())
+        return None
+
+    def _assertIndexed(self, queryset, covering=False):
+        plan = self._plan(queryset)
+        if plan is None:
+            return
+        if connection.vendor == 'sqlite':
+            self.assertTrue('object_pk=?' in plan, plan)
+            if covering:
+                self.assertTrue('COVERING INDEX' in plan, plan)
+        else:
+            self.assertTrue('Index' in plan, plan)
+            self.assertFalse('Seq Scan' in plan, plan)
+
+    def testPendingFor(self):
+        ct = ContentType.objects.get_for_model(User)
+        queryset = DeferredAction.objects.pending().filter(content_type=ct, object_pk=self.user.pk)
+        # every column pending_for() needs is in the index
+        self._assertIndexed(queryset.values_list('valid_until'), covering=True)
+
+    def testPendingCounts(self):
+        ct = ContentType.objects.get_for_model(User)
+        self._assertIndexed(DeferredAction.objects.pending().filter(
+            content_type=ct, object_pk__in=[str(self.user.pk), '0']).values_list('object_pk'))
+
+    def testSupersede(self):
+        ct = ContentType.objects.get_for_model(User)
+        self._assertIndexed(DeferredAction.objects.pending().filter(content_type=ct,
+            form_class='generic_confirmation.tests.EmailChangeForm',
+            object_pk__in=[str(self.user.pk)]).values_list('pk'))
+
+
+class BulkExpireTestCase(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user('user%d' % i, 'user%d@example.com' % i, '123456')
+                      for i in range(23, 26)]
+        for user in self.users:
+            for i in range(2):
+                self._defer(user, requested_by=self.users[0])
+        self.group = Group.objects.create(name='group23')
+        form = GroupNameChangeForm({'name': 'group24'}, instance=self.group)
+        self.assertTrue(form.is_valid())
+        form.save()
+        self.received = []
+        signals.pending_expired.connect(self._receiver)
+        signals.actions_cancelled.connect(self._receiver)
+
+    def tearDown(self):
+        signals.pending_expired.disconnect(self._receiver)
+        signals.actions_cancelled.disconnect(self._receiver)
+
+    def _receiver(self, sender, signal, **kwargs):
+        kwargs.pop('object_pks', None)
+        self.received.append((signal, sender, kwargs['count']))
+
+    def _defer(self, user, requested_by=None):
+        form = EmailChangeForm({'email': 'xxx@example.com'}, instance=user)
+        self.assertTrue(form.is_valid())
+        return form.save(requested_by)
+
+    def _pending(self):
+        return dict((user, DeferredAction.objects.pending_for(user)) for user in self.users)
+
+    def testExpireInstance(self):
+        with self.assertNumQueries(1):
+            self.assertEquals(DeferredAction.objects.expire_pending_for(self.users[0]), 2)
+        self.assertEquals(self._pending(), {self.users[0]: 0, self.users[1]: 2, self.users[2]: 2})
+        self.assertEquals(self.received, [(signals.pending_expired, User, 2)])
+        # expired actions are kept for the history
+        self.assertEquals(DeferredAction.objects.count(), 7)
+
+    def testExpiredWhileConfirming(self):
+        token = DeferredAction.objects.filter(object_pk=self.users[0].pk)[0].token
+        confirmation = ConfirmationForm({'token': token})
+        self.assertTrue(confirmation.is_valid())
+        DeferredAction.objects.expire_pending_for(self.users[0])
+        self.assertFalse(confirmation.save())
+        self.assertEquals(DeferredAction.objects.confirm_many([token]), {token: False})
+        self.assertFalse(DeferredAction.objects.get(token=token).confirmed)
+
+    def testExpireQueryset(self):
+        count = DeferredAction.objects.expire_pending_for(User.objects.filter(pk__in=[
+            self.users[0].pk, self.users[1].pk]))
+        self.assertEquals(count, 4)
+        self.assertEquals(self._pending(), {self.users[0]: 0, self.users[1]: 0, self.users[2]: 2})
+
+    def testExpireModel(self):
+        self.assertEquals(DeferredAction.objects.expire_pending_for(User), 6)
+        self.assertEquals(DeferredAction.objects.pending_for(self.group), 1)
+        self.assertEquals(self.received, [(signals.pending_expired, User, 6)])
+
+    def testExpireActions(self):
+        count = DeferredAction.objects.expire_actions(DeferredAction.objects.all())
+        self.assertEquals(count, 7)
+        self.assertEquals(sorted(self.received, key=lambda item: item[1].__name__),
+                          [(signals.pending_expired, Group, 1),
+                           (signals.pending_expired, User, 6)])
+
+    def testNoSelfSubqueries(self):
+        # MySQL rejects UPDATE and DELETE with a subquery on the same table
+        with CaptureQueriesContext(connection) as queries:
+            DeferredAction.objects.expire_actions(DeferredAction.objects.filter(
+                object_pk=self.users[0].pk))
+            DeferredAction.objects.cancel_actions(DeferredAction.objects.filter(
+                object_pk=self.users[1].pk))
+        # Django 1.8 logs sqlite queries as "QUERY = '...' - PARAMS = (...)"
+        writes = [query['sql'] for query in queries
+                  if re.match(r"(QUERY = ')?(UPDATE|DELETE) ", query['sql'])]
+        self.assertEquals(len(writes), 2)
+        self.assertFalse(any('SELECT' in sql for sql in writes), writes)
+        self.assertEquals(DeferredAction.objects.pending_for(self.users[0]), 0)
+        self.assertEquals(DeferredAction.objects.count(), 5)
+
+    def testCancelForUser(self):
+        self._defer(self.users[1], requested_by=self.users[1])
+        self.assertEquals(DeferredAction.objects.cancel_for_user(self.users[0]), 6)
+        self.assertEquals(DeferredAction.objects.count(), 2)
+        self.assertEquals(self._pending(), {self.users[0]: 0, self.users[1]: 1, self.users[2]: 0})
+        self.assertEquals(self.received, [(signals.actions_cancelled, User, 6)])
+
+    @override_settings(GENERIC_CONFIRMATION_PENDING_CACHE='default')
+    def testCacheInvalidation(self):
+        cache.clear()
+        try:
+            self.assertEquals(self._pending(), {self.users[0]: 2, self.users[1]: 2, self.users[2]: 2})
+            DeferredAction.objects.expire_pending_for(self.users[0])
+            self.assertEquals(self._pending(), {self.users[0]: 0, self.users[1]: 2, self.users[2]: 2})
+            DeferredAction.objects.expire_pending_for(User)
+            self.assertEquals(self._pending(), {self.users[0]: 0, self.users[1]: 0, self.users[2]: 0})
+            self._defer(self.users[1])
+            self.assertEquals(DeferredAction.objects.pending_for(self.users[1]), 1)
+            DeferredAction.objects.cancel_for_user(None)
+            self.assertEquals(self._pending(), {self.users[0]: 0, self.users[1]: 0, self.users[2]: 0})
+        finally:
+            cache.clear()
+
+    def testAdminActions(self):
+        User.objects.create_superuser('user26', 'user26@example.com', '123456')
+        self.client.login(username='user26', password='123456')
+        url = reverse('admin:generic_confirmation_deferredaction_changelist')
+        actions = list(DeferredAction.objects.order_by('pk'))
+
+        def run(action, selected):
+            self.client.post(url, {'action': action, 'index': 0,
+                                   '_selected_action': [a.pk for a in selected]})
+
+        run('expire_selected', actions[:2])
+        self.assertEquals(DeferredAction.objects.pending_for(self.users[0]), 0)
+        run('confirm_selected', actions[2:3])
+        self.assertEquals(User.objects.get(pk=self.users[1].pk).email, 'xxx@example.com')
+        run('cancel_selected', actions[:4])
+        self.assertEquals(DeferredAction.objects.count(), 4)
+
+
 @override_settings(ROOT_URLCONF="generic_confirmation.tests.urls")
 class ViewTestCase(TestCase):
     """
@@ -556,6 +1660,72 @@ class PickledObjectFieldTests(TestCase):
             model_test.delete()
 
 
+class FormInputFieldTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user14', 'user14@example.com', '123456')
+
+    def _roundtrip(self, value):
+        action = DeferredAction.objects.create(token='roundtrip', form_class='x.Y',
+                                               form_input=value)
+        return DeferredAction.objects.get(pk=action.pk).form_input
+
+    def testQueryDict(self):
+        value = self._roundtrip(QueryDict("email=test@example.com&test=1&test=2"))
+        self.assertEquals(value['email'], 'test@example.com')
+        self.assertEquals(value.getlist('test'), ['1', '2'])
+
+    def testDict(self):
+        value = self._roundtrip({'email': 'test@example.com', 'groups': [1, 2], 'flag': None})
+        self.assertEquals(value['email'], 'test@example.com')
+        self.assertEquals(value.getlist('groups'), [1, 2])
+        self.assertEquals(value['flag'], None)
+
+    def testCompact(self):
+        data = JSONSerializer().dumps(QueryDict("email=test@example.com&test=1&test=2"))
+        self.assertFalse(' ' in data)
+        self.assertEquals(json.loads(data), {'email': ['test@example.com'], 'test': ['1', '2']})
+
+    def testLazyDecoding(self):
+        DeferredAction.objects.create(token='lazy', form_class='x.Y',
+                                      form_input={'email': 'test@example.com'})
+        action = DeferredAction.objects.get(token='lazy')
+        self.assertTrue(isinstance(action.__dict__['form_input'], SerializedFormInput))
+        self.assertEquals(action.form_input['email'], 'test@example.com')
+        self.assertFalse(isinstance(action.__dict__['form_input'], SerializedFormInput))
+
+        # an untouched value is written back as it was loaded
+        action = DeferredAction.objects.get(token='lazy')
+        action.description = 'changed'
+        action.save()
+        self.assertTrue(isinstance(action.__dict__['form_input'], SerializedFormInput))
+        self.assertEquals(DeferredAction.objects.get(token='lazy').form_input['email'],
+                          'test@example.com')
+
+    def testDeferred(self):
+        DeferredAction.objects.create(token='deferred', form_class='x.Y',
+                                      form_input={'email': 'test@example.com'})
+        action = DeferredAction.objects.defer('form_input').get(token='deferred')
+        with self.assertNumQueries(1):
+            self.assertEquals(action.form_input['email'], 'test@example.com')
+
+    @override_settings(GENERIC_CONFIRMATION_SERIALIZER='generic_confirmation.serializers.PickleSerializer')
+    def testPickleSerializer(self):
+        value = self._roundtrip(QueryDict("email=test@example.com&test=1&test=2"))
+        self.assertEquals(value, QueryDict("email=test@example.com&test=1&test=2"))
+        self.assertEquals(PickleSerializer().loads(PickleSerializer().dumps(value)), value)
+
+    def testResumeMultiValue(self):
+        group1 = Group.objects.create(name='group14a')
+        group2 = Group.objects.create(name='group14b')
+        form = GroupChangeForm(QueryDict('groups=%d&groups=%d' % (group1.pk, group2.pk)),
+                               instance=self.user)
+        self.assertTrue(form.is_valid())
+        token = form.save()
+        DeferredAction.objects.confirm(token)
+        self.assertEquals(list(User.objects.get(pk=self.user.pk).groups.order_by('pk')),
+                          [group1, group2])
+
+
 class TestingModelForm(DeferredForm):
     class Meta:
         model = TestingModel
@@ -0,0 +1,106 @@
+"""
+Optional throttling of failed confirmations.
+
+Enable it by naming a cache alias in ``GENERIC_CONFIRMATION_THROTTLE_CACHE``.
+Failed confirmations are then counted per client IP (in the views) and per
+token prefix (in ``ConfirmationForm``); once ``GENERIC_CONFIRMATION_THROTTLE_LIMIT``
+(default 20) failures were counted within ``GENERIC_CONFIRMATION_THROTTLE_TIMEOUT``
+seconds (default 60), further attempts are rejected without a query. Unknown
+tokens are remembered for ``GENERIC_CONFIRMATION_NEGATIVE_CACHE_TIMEOUT``
+seconds (default 60), so that repeating them doesn't query the database
+either.
+
+"""
+import hashlib
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.encoding import force_bytes
+
+
+def get_cache():
+    """ returns the configured cache or None if throttling is disabled """
+    alias = getattr(settings, 'GENERIC_CONFIRMATION_THROTTLE_CACHE', None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def get_limit():
+    return getattr(settings, 'GENERIC_CONFIRMATION_THROTTLE_LIMIT', 20)
+
+
+def get_timeout():
+    return getattr(settings, 'GENERIC_CONFIRMATION_THROTTLE_TIMEOUT', 60)
+
+
+def get_prefix_length():
+    return getattr(settings, 'GENERIC_CONFIRMATION_THROTTLE_PREFIX_LENGTH', 2)
+
+
+def _key(kind, value):
+    # tokens and addresses are user input, hashing keeps the keys valid
+    # for every cache backend
+    return 'generic_confirmation:%s:%s' % (kind, hashlib.md5(force_bytes(value)).hexdigest())
+
+
+def ip_key(address):
+    return _key('ip', address)
+
+
+def prefix_key(token):
+    return _key('prefix', token[:get_prefix_length()])
+
+
+def unknown_key(token):
+    return _key('unknown', token)
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _is_exceeded(cache, key):
+    return (cache.get(key) or 0) >= get_limit()
+
+
+def _count(cache, key):
+    timeout = get_timeout()
+    # add() starts a new window, incr() keeps its expiry
+    cache.add(key, 0, timeout)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # expired between add() and incr()
+        cache.set(key, 1, timeout)
+
+
+def is_ip_throttled(request):
+    cache = get_cache()
+    return cache is not None and _is_exceeded(cache, ip_key(client_ip(request)))
+
+
+def ip_failed(request):
+    cache = get_cache()
+    if cache is not None:
+        _count(cache, ip_key(client_ip(request)))
+
+
+def is_token_throttled(token):
+    cache = get_cache()
+    return cache is not None and _is_exceeded(cache, prefix_key(token))
+
+
+def is_known_unknown(token):
+    """ returns True if ``token`` was recently found to be unknown """
+    cache = get_cache()
+    return cache is not None and cache.get(unknown_key(token)) is not None
+
+
+def token_failed(token):
+    """ counts a failure for the prefix of ``token`` and remembers it """
+    cache = get_cache()
+    if cache is None:
+        return
+    _count(cache, prefix_key(token))
+    cache.set(unknown_key(token), True,
+              getattr(settings, 'GENERIC_CONFIRMATION_NEGATIVE_CACHE_TIMEOUT', 60))
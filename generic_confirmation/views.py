@@ -3,6 +3,7 @@ from django.template import RequestContext
 from django.http import HttpResponseRedirect
 from django.contrib import messages
 from generic_confirmation.forms import ConfirmationForm
+from generic_confirmation import throttle
 
 
 def _compat_is_authenticated(user):
@@ -26,8 +27,14 @@ def confirm_by_form(request, template_name='confirm.html',
     be rendered once the confirmation is complete. The ``success_message``
     will then be added to the template context instead of the message_set.
 
+    Clients with too many failed attempts get the template with status 429
+    (see ``generic_confirmation.throttle``).
+
     """
     if request.method == 'POST':
+        if throttle.is_ip_throttled(request):
+            return render(request, template_name, {'form': form_class(), 'throttled': True},
+                          status=429)
         form = form_class(request.POST)
         if form.is_valid():
             form.save()
@@ -38,6 +45,7 @@ def confirm_by_form(request, template_name='confirm.html',
                 if success_message is not None and _compat_is_authenticated(request.user):
                     messages.add_message(request, messages.SUCCESS, success_message)
                 return HttpResponseRedirect(success_url)
+        throttle.ip_failed(request)
     else:
         form = form_class()
     return render(request, template_name, {'form': form})
@@ -48,6 +56,8 @@ def confirm_by_get(request, token, template_name='confirm.html',
                    success_template_name="confirmed.html",
                    success_url=None, success_message=None,
                    form_class=ConfirmationForm):
+    if throttle.is_ip_throttled(request):
+        return render(request, template_name, {'throttled': True}, status=429)
     form = form_class({'token': token})
     if form.is_valid():
         form.save()
@@ -59,4 +69,5 @@ def confirm_by_get(request, token, template_name='confirm.html',
                 messages.add_message(request, messages.SUCCESS, success_message)
             return HttpResponseRedirect(success_url)
     else:
+        throttle.ip_failed(request)
         return render(request, template_name, {})
@@ -10,6 +10,8 @@ setup(
     packages=(
         'generic_confirmation',
         'generic_confirmation.templatetags',
+        'generic_confirmation.management',
+        'generic_confirmation.management.commands',
         'generic_confirmation.tests',
         'generic_confirmation.migrations',
     ),